@@ -3,17 +3,22 @@
 import os
 import sys
 import time
-import random
 import datetime
 import argparse
-import urllib.request
-import requests
 import platform
-import shutil
-import glob
+import threading
+import concurrent.futures
 
-from PIL import Image
 from common_logger import Logger
+from common_library import open_library_index, library_add, library_remove
+from common_image import probe_image_size, ImageStreamValidator
+from VerifyWallpaper import verify_library
+from common_http import http_get_retry, download_to_file, hedged_download, log_breaker_summary
+from common_cache import open_metadata_cache
+from common_stats import open_source_stats
+from common_prohui import prohui_list, get_prohui_entry_by_date
+from common_identity import get_wallpaper_stem, is_same_wallpaper, build_id_index
+from common_blobstore import set_blob_store, open_blob_store, link_or_copy, copy_file, store_image
 
 """
 https://bing.ioliu.cn/v1/?type=json&d=1&w=1920&h=1080
@@ -28,6 +33,8 @@ http://www.prohui.com/wallpaper/OHR.SpringBadlands_ZH-CN8280871661_1920x1080.jpg
 
 logger = Logger('BING_WP')
 
+IMAGE_HEIGHT = 1080     # 壁纸图片要求的高度
+
 
 def get_date_from_today_by_delta(idate_delta):
     """
@@ -63,23 +70,16 @@ def check_download_image(image_dir):
         return False
 
     try:
-        img = Image.open(image_dir)
-        imgSize = img.size       # 图片尺寸
-        imgwd = img.width        # 图片的宽
-        imght = img.height       # 图片的高
-        imgft = img.format       # 图像格式
-
-        logger.info("the download file size: %s" % str(imgSize))
-        logger.info("the image file width: %s" % str(imgwd))
-        logger.info("the file height: %s" % str(imght))
-        logger.info("the file format: %s" % str(imgft))
-
-        if int(imght) != 1080:
+        imgwd, imght, imgft = probe_image_size(image_dir)     # 图片的宽、高和格式
+
+        logger.debug("the image file size: %s x %s %s" % (str(imgwd), str(imght), str(imgft)))
+
+        if int(imght) != IMAGE_HEIGHT:
             try:
                 if os.path.exists(image_dir):
                     os.remove(image_dir)
+                    library_remove(image_dir)
                     logger.info("the damaged file is delete: %s" % str(image_dir))
-                    time.sleep(0.1)
             except Exception as e:
                 pass
 
@@ -93,8 +93,8 @@ def check_download_image(image_dir):
         try:
             if os.path.exists(image_dir):
                 os.remove(image_dir)
+                library_remove(image_dir)
                 logger.info("the damaged file is delete: %s" % str(image_dir))
-                time.sleep(0.1)
         except Exception as e:
             pass
 
@@ -120,17 +120,11 @@ def list_all_files(rootdir):
 
 def test_check_image(root_dir):
     """
-    开始下载指定的某一张图片并保存
-    1、图片带路径名称
-    2、和下载地址
+    检查整个目录的图片，删除有问题的图片，参考VerifyWallpaper.py
+    1、图片存放的根目录
     """
 
-    all_files = list_all_files(root_dir)
-    for i in range(0, len(all_files)):
-        image_path = all_files[i]
-        check_download_image(image_path)
-
-    logger.info("File Count: %s" % str(i))
+    verify_library(root_dir)
 
 
 def download_one_image(image_path_name, image_url):
@@ -142,15 +136,7 @@ def download_one_image(image_path_name, image_url):
 
     logger.info("++==begin download image: %s" % image_url)
     try:
-        response = requests.get(image_url)
-        if response.status_code != 200:
-            logger.error("download the wallpaper error: %s" % image_url)
-            return False
-
-        with open(image_path_name, "wb") as code:
-            code.write(response.content)
-
-        return True
+        return download_to_file(image_url, image_path_name, ImageStreamValidator(IMAGE_HEIGHT))
 
     except Exception as e:
         logger.error("can not connect website when download: %s" % str(e))
@@ -164,71 +150,94 @@ def chceck_image_exist_by_date(image_date, wp_root_dir):
     2、图片下载存在根目录
     """
 
-    img_pattern_path = wp_root_dir + os.sep + str(image_date) + '_*.jpg'
+    return open_library_index(wp_root_dir).find(image_date)
 
-    match_image = glob.glob(img_pattern_path)
-    iCount = len(match_image)
-    if iCount > 0:
-        image_name = match_image[0]
-    else:
-        image_name = ''
 
-    # print(iCount, image_name)
-    return iCount, image_name
+def get_wallpaper_url_prohui(image_name):
+    """
+    通过图片名称拼接prohui的下载地址
+    1、图片带路径名称
+    """
 
+    URL_HUI = 'http://cdn.prohui.com/wallpaper/OHR.'
+
+    image_stem = get_wallpaper_stem(image_name)
+    if image_stem == '':
+        return ''
 
-def get_url_content(url):
-    '''
-    获取403禁止访问的网页
-    1、获取内容的链接地址
-    '''
+    return URL_HUI + image_stem + '_1920x1080.jpg'
 
-    headers = ["Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36"
-               " (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36",
-               "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.36"
-               " (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36",
-               "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:30.0) Gecko/20100101 Firefox/30.0"
-               "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.75.14"
-               " (KHTML, like Gecko) Version/7.0.3 Safari/537.75.14",
-               "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2; Win64; x64; Trident/6.0)"]
 
-    randdom_header = random.choice(headers)
-    req = urllib.request.Request(url)
-    req.add_header("User-Agent", randdom_header)
-    content = urllib.request.urlopen(req).read()
-    return content
+URL_IOLIU_LIST = "https://bing.ioliu.cn/v1/list"
+IOLIU_LIST_SIZE = 100       # ioliu列表接口每页返回的天数
 
 
-def get_wallpaper_from_prohui(wp_root_dir, idate_delta):
+class IoliuListResolver(object):
     """
-    获取ioliu下载指定的某一张图片的地址，
-    1、图片存放地址
-    2、日期间隔
+    ioliu壁纸列表的批量解析器，一次请求获取多天的图片信息，按日期建立索引
+    1、每页获取的天数
     """
 
-    URL_HUI = 'http://cdn.prohui.com/wallpaper/OHR.'
+    def __init__(self, page_size=IOLIU_LIST_SIZE):
+        self.page_size = page_size
+        self.images = {}
+        self.pages = set()
+        self.lock = threading.Lock()
 
-    image_name, image_url, image_date = get_wallpaper_url_ioliu(wp_root_dir, idate_delta)
+    def reset(self):
+        """
+        清空已经获取的列表
+        """
 
-    if image_name == '':
-        return False
+        with self.lock:
+            self.images = {}
+            self.pages = set()
 
-    mini_image_name = image_name.split("\\")
-    mini_image_name = mini_image_name[len(mini_image_name) - 1]
-    mini_image_name = mini_image_name[9:-4]
+    def fetch_page(self, page):
+        """
+        获取列表的某一页，按日期从新到旧排列，失败返回空列表
+        1、页码，从1开始
+        """
 
-    image_url_hui = URL_HUI + mini_image_name + '_1920x1080.jpg'
+        payload = {'type': 'json',
+                   'p': page,
+                   'size': self.page_size,
+                   'w': 1920,
+                   'h': 1080}
+        response = http_get_retry(URL_IOLIU_LIST, params=payload)
+        if response is None:
+            logger.error("network error,can not get the wallpaper list: %s" % str(page))
+            return []
 
-    try:
-        picture_data = get_url_content(image_url_hui)
-        with open(image_name, "wb") as code:
-            code.write(picture_data)
+        try:
+            image_data = response.json()
+            if image_data["status"]["code"] != 200:
+                logger.error("can not find the wallpaper list in the website: %s" % str(page))
+                return []
 
-    except Exception as e:
-        logger.error("download image from prohui error: %s" % str(e))
-        return False
+            return image_data["data"]
+        except Exception as e:
+            logger.error("the wallpaper list format not correct: %s" % str(e))
+            return []
 
-    return True
+    def get(self, image_date, idate_delta):
+        """
+        通过日期获取列表中的图片信息，所在的页没有获取过时先获取整页，没有则返回None
+        1、图片日期
+        2、日期间隔，用于计算所在的页
+        """
+
+        page = int(idate_delta) // self.page_size + 1
+        with self.lock:     # 每一页只请求一次，失败的页也不再重复请求
+            if page not in self.pages:
+                self.pages.add(page)
+                for image in self.fetch_page(page):
+                    self.images[image["enddate"]] = image
+
+        return self.images.get(str(image_date))
+
+
+ioliu_list = IoliuListResolver()
 
 
 def get_wallpaper_url_ioliu(image_dir, idate_delta):
@@ -242,43 +251,139 @@ def get_wallpaper_url_ioliu(image_dir, idate_delta):
 
     image_date = get_date_from_today_by_delta(idate_delta)
 
+    metadata_cache = open_metadata_cache(image_dir)
+    if metadata_cache is not None:
+        cached = metadata_cache.get('ioliu', MARKET, image_date)
+        if cached is not None:
+            return image_dir + os.sep + cached[0], cached[1], cached[2]
+
+    image = ioliu_list.get(image_date, idate_delta)
+    if image is not None:
+        image_path_new_name, image_new_url, end_date = parse_wallpaper_ioliu(image_dir, image)
+        if metadata_cache is not None and image_path_new_name != '':
+            metadata_cache.put('ioliu', MARKET, image_date, os.path.basename(image_path_new_name),
+                               image_new_url, end_date)
+        return image_path_new_name, image_new_url, end_date
+
     payload = {'type': 'json',
                'd': idate_delta,  # 距离今天第delta天壁纸
                'w': 1920,
                'h': 1080}
+    response = http_get_retry(URL_API, params=payload)
+    if response is None:
+        logger.error("network error,can not get the wallpaper download url")
+        return '', '', image_date
+
     try:
-        response = requests.get(URL_API, params=payload)
-
-        if response.status_code != 200:
-            time.sleep(3)
-            response = requests.get(URL_API, params=payload)
-            if response.status_code != 200:
-                time.sleep(3)
-                response = requests.get(URL_API, params=payload)
-                if response.status_code != 200:
-                    logger.error("network error,can not get the wallpaper download url")
-                    return '', '', image_date
-        else:
-            if response.json()["status"]["code"] != 200:
-                logger.error("can not find the wallpaper in the website")
-                return '', '', image_date
+        image_data = response.json()
+    except Exception as e:
+        logger.error("the wallpaper data format not correct: %s" % str(e))
+        return '', '', image_date
 
-    except:
-        logger.error("network error,can not connect the website")
+    if image_data["status"]["code"] != 200:
+        logger.error("can not find the wallpaper in the website")
         return '', '', image_date
 
-    image_data = response.json()
-    image_url = image_data["data"]["url"]
-    end_date = image_data["data"]["enddate"]    
+    image_path_new_name, image_new_url, end_date = parse_wallpaper_ioliu(image_dir, image_data["data"])
+    if metadata_cache is not None and image_path_new_name != '':
+        metadata_cache.put('ioliu', MARKET, image_date, os.path.basename(image_path_new_name),
+                           image_new_url, end_date)
+
+    return image_path_new_name, image_new_url, end_date
+
+
+def parse_wallpaper_ioliu(image_dir, image_data, url_photo='https://bing.ioliu.cn/photo/'):
+    """
+    从ioliu接口返回的图片信息中解析图片名称和下载地址
+    1、图片存放地址
+    2、接口返回的data数据
+    3、ioliu图片下载的基地址
+    """
+
+    image_url = image_data["url"]
+    end_date = image_data["enddate"]
     logger.info("get_image: %s %s" % (end_date, image_url))
-    str_pic_url = image_url.split("/")
-    str_pic_name = str_pic_url[len(str_pic_url) - 1].replace('_1920x1080.jpg', '')
-    image_new_url = 'https://bing.ioliu.cn/photo/' + str_pic_name + '?force=download'
-    image_path_new_name = image_dir + os.sep + end_date + '_' + str_pic_name + ".jpg"
-    #image_path_old_name = image_dir + os.sep + str_pic_name + ".jpg"
+    image_stem = get_wallpaper_stem(image_url)     # 名称不符合格式时使用文件名
+    if image_stem == '':
+        logger.error("the wallpaper name format not correct: %s" % image_url)
+        return '', '', end_date
+
+    image_new_url = url_photo + image_stem + '?force=download'
+    image_path_new_name = image_dir + os.sep + end_date + '_' + image_stem + '.jpg'
     return image_path_new_name, image_new_url, end_date
 
 
+MARKET = 'zh-CN'
+URL_BING = "http://cn.bing.com"
+URL_BING_API = "http://cn.bing.com/HPImageArchive.aspx"
+BING_ARCHIVE_PAGE = 8       # 必应归档接口单次最多返回8张
+BING_ARCHIVE_DEPTH = 16     # 必应归档接口最多可以回溯的天数
+
+
+class BingArchiveResolver(object):
+    """
+    必应官方壁纸归档解析器，归档接口的每一页每次运行只请求一次，按日期建立索引
+    1、区域市场，默认zh-CN
+    """
+
+    def __init__(self, market='zh-CN'):
+        self.market = market
+        self.images = {}
+        self.pages = set()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """
+        清空已经获取的归档，下一次查询重新请求接口
+        """
+
+        with self.lock:
+            self.images = {}
+            self.pages = set()
+
+    def fetch_page(self, idx):
+        """
+        获取归档接口的某一页
+        1、距离今天的起始偏移
+        """
+
+        payload = {'format': 'js',
+                   'idx': idx,
+                   'n': BING_ARCHIVE_PAGE,
+                   'mkt': self.market}
+        response = http_get_retry(URL_BING_API, params=payload)
+        if response is None:
+            logger.error("network error,can not get the wallpaper download url")
+            return []
+
+        try:
+            return response.json().get("images", [])
+        except Exception as e:
+            logger.error("the bing archive format not correct: %s" % str(e))
+            return []
+
+    def get(self, image_date, idate_delta):
+        """
+        通过日期获取归档中的图片信息，只请求日期所在的那一页，没有则返回None
+        1、图片日期
+        2、日期间隔，用于计算所在的页
+        """
+
+        idx = int(idate_delta) // BING_ARCHIVE_PAGE * BING_ARCHIVE_PAGE
+        with self.lock:     # 并发下载时每一页只允许一个线程请求
+            if idx not in self.pages:
+                self.pages.add(idx)
+                page = self.fetch_page(idx)
+                for image in page:
+                    self.images.setdefault(image["enddate"], image)
+                logger.info("get %s wallpapers from bing archive page: %s" % (str(len(page)), str(idx)))
+
+        return self.images.get(str(image_date))
+
+
+bing_archive = BingArchiveResolver(MARKET)
+
+
 def get_wallpaper_url_bing(image_dir, idate_delta):
     """
     获取必应官方下载指定的某一张图片的地址，
@@ -286,91 +391,236 @@ def get_wallpaper_url_bing(image_dir, idate_delta):
     2、日期间隔
     """
 
-    if idate_delta >= 8:
+    if idate_delta >= BING_ARCHIVE_DEPTH:
         return '', '', ''
 
-    URL_BING = "http://cn.bing.com"
-    URL_API = "http://cn.bing.com/HPImageArchive.aspx"
-
     image_date = get_date_from_today_by_delta(idate_delta)
 
-    payload = {'format': 'js',
-               'idx': 0,
-               'n': 10,
-               'mkt': 'zh-CN'}
-    try:
-        response = requests.get(URL_API, params=payload)
-
-        if response.status_code != 200:
-            time.sleep(3)
-            response = requests.get(URL_API, params=payload)
-            if response.status_code != 200:
-                time.sleep(3)
-                response = requests.get(URL_API, params=payload)
-                if response.status_code != 200:
-                    logger.error("network error,can not get the wallpaper download url")
-                    return '', '', image_date
-    except:
-        logger.error("network error,can not connect the website")
-        return '', '', image_date
+    metadata_cache = open_metadata_cache(image_dir)
+    if metadata_cache is not None:
+        cached = metadata_cache.get('bing', MARKET, image_date)
+        if cached is not None:
+            return image_dir + os.sep + cached[0], cached[1], cached[2]
 
-    images = response.json()
-    icount = 0
-    image_path_new_name = ''
-    image_new_url = ''
-    image_enddate = ''
-    while icount < len(images["images"]):
-        image_new_url = URL_BING + images["images"][icount]["url"]
-        image_enddate = images["images"][icount]["enddate"]
-        icount = icount + 1
-
-        if image_enddate == image_date:
-            arr_pic_url = image_new_url.split("/")
-            str_pic_url = arr_pic_url[len(arr_pic_url) - 1]
-            name_index_start = len("th?id=OHR.")
-            name_index_endin = str_pic_url.index("_1920x1080.jpg&rf")
-            str_pic_name = str_pic_url[name_index_start:name_index_endin]
-            image_path_new_name = image_dir + os.sep + image_enddate + '_' + str_pic_name + ".jpg"
-            break
+    image = bing_archive.get(image_date, idate_delta)
+    if image is None:
+        return '', '', ''
+
+    image_path_new_name, image_new_url, image_enddate = parse_wallpaper_bing(image_dir, image)
+    if metadata_cache is not None and image_path_new_name != '':
+        metadata_cache.put('bing', MARKET, image_date, os.path.basename(image_path_new_name),
+                           image_new_url, image_enddate)
+        if image.get("hsh", '') != '':
+            metadata_cache.put_hash(MARKET, image_date, image["hsh"], image.get("urlbase", ''),
+                                    os.path.basename(image_path_new_name))
+
+    return image_path_new_name, image_new_url, image_enddate
+
+
+def find_same_hash_image(wp_root_dir, image_date, image_name):
+    """
+    通过必应图片哈希查找壁纸目录中其他日期或其他区域的同一张图片，返回带路径名称，没有返回''
+    1、图片存放地址
+    2、图片日期
+    3、图片带路径名称，查找结果不包括它自己
+    """
+
+    metadata_cache = open_metadata_cache(wp_root_dir)
+    if metadata_cache is None:
+        return ''
+
+    row = metadata_cache.get_hash(MARKET, image_date)
+    if row is None:
+        return ''
+
+    library_index = open_library_index(wp_root_dir)
+    for market, other_date, other_name in metadata_cache.find_hash(row[0]):
+        if other_name != os.path.basename(image_name) and library_index.exists(other_name):
+            logger.info("the same bing image exists: %s %s %s" % (market, other_date, other_name))
+            return wp_root_dir + os.sep + other_name
+
+    return ''
+
+
+def parse_wallpaper_bing(image_dir, image, url_bing=URL_BING):
+    """
+    从必应归档的图片信息中解析图片名称和下载地址
+    1、图片存放地址
+    2、归档中某一天的图片信息
+    3、必应官网的基地址
+    """
+
+    image_new_url = url_bing + image["url"]
+    image_enddate = image["enddate"]
+
+    image_stem = get_wallpaper_stem(image["url"])      # 名称不符合格式时使用文件名
+    if image_stem == '':
+        logger.error("the wallpaper name format not correct: %s" % image_new_url)
+        return '', '', ''
+
+    image_path_new_name = image_dir + os.sep + image_enddate + '_' + image_stem + '.jpg'
 
     return image_path_new_name, image_new_url, image_enddate
 
 
-def check_and_copy_exist_image(image_name):
+saved_pictures = {}     # 壁纸工具保存目录 -> 按壁纸标识建立的索引
+saved_pictures_lock = threading.Lock()
+
+
+def find_exist_image(image_name):
     """
-    检查壁纸工具保存的壁纸是否存在已经下载的图片并拷贝到目标目录
+    查找壁纸工具保存的壁纸中是否存在已经下载的图片，返回找到的图片路径，没有返回''
     1、图片名称--用于名称比对，确认是否一致
     """
 
     if image_name == "":
-        return False
+        return ''
 
     local_save_path = "C:\\Users\\Test\\Pictures\\Saved Pictures"
 
-    mini_image_name = image_name.split("\\")
-    mini_image_name = mini_image_name[len(mini_image_name) - 1]
-    mini_image_name = mini_image_name[9:-4]
+    with saved_pictures_lock:   # 保存目录只遍历一次，之后按标识直接查找
+        if local_save_path not in saved_pictures:
+            saved_pictures[local_save_path] = build_id_index(local_save_path, '1920x1080')
+        local_image_name = saved_pictures[local_save_path].get(image_name)
 
-    local_image_name_old = local_save_path + os.sep + mini_image_name + '_1920x1080.jpg'
-    local_image_name_ohr = local_save_path + os.sep + 'OHR.' + mini_image_name + '_1920x1080.jpg'
+    if local_image_name is None or not os.path.exists(local_image_name):
+        return ''
 
-    if os.path.exists(local_image_name_old):
-        shutil.copyfile(local_image_name_old, image_name)
-        return True
+    return local_image_name
+
+
+class WallpaperProvider(object):
+    """
+    壁纸来源，resolve获取某一天的下载地址，fetch下载并校验图片
+    下载任务task为字典：image_name、image_url(ioliu)、image_url_bing、judge_down_from_bing、
+    image_date、idate_delta、wp_root_dir
+    """
+
+    name = ''
+    network = True      # 网络来源才参与对冲下载
+
+    def resolve(self, task):
+        """
+        获取下载地址，该来源不可用时返回''
+        1、下载任务
+        """
+
+        return ''
+
+    def fetch(self, task, image_url):
+        """
+        下载图片并校验，成功返回True
+        1、下载任务
+        2、下载地址
+        """
+
+        return download_one_image(task['image_name'], image_url)
+
+
+class BingProvider(WallpaperProvider):
+    """
+    必应官网，只有最近几天并且名称与ioliu一致时可用
+    """
 
-    if os.path.exists(local_image_name_ohr):
-        shutil.copyfile(local_image_name_ohr, image_name)
+    name = 'bing'
+
+    def resolve(self, task):
+        if task['judge_down_from_bing']:
+            return task['image_url_bing']
+        return ''
+
+
+class IoliuProvider(WallpaperProvider):
+    """
+    ioliu网站
+    """
+
+    name = 'ioliu'
+
+    def resolve(self, task):
+        if task['image_name'] != '':
+            return task['image_url']
+        return ''
+
+
+class LocalProvider(WallpaperProvider):
+    """
+    壁纸目录中其他日期的同一张壁纸，或者壁纸工具在本地保存的图片
+    """
+
+    name = 'local'
+    network = False
+
+    def resolve(self, task):
+        if task['image_name'] == '':
+            return ''
+
+        library_image = open_library_index(task['wp_root_dir']).find_id(task['image_name'])
+        if library_image != '' and library_image != task['image_name']:
+            return library_image
+
+        return find_exist_image(task['image_name'])
+
+    def fetch(self, task, image_url):
+        if open_blob_store() is not None:
+            link_or_copy(image_url, task['image_name'])     # 启用存储时同一个文件系统只建立硬链接
+        else:
+            copy_file(image_url, task['image_name'])        # 不和壁纸工具保存的图片共用同一个文件
+        if not check_download_image(task['image_name']):
+            return False
+
+        store_image(task['image_name'])
+        library_add(task['image_name'])
         return True
 
-    return False
 
+class ProhuiProvider(WallpaperProvider):
+    """
+    壁纸网站prohui
+    """
+
+    name = 'prohui'
+
+    def resolve(self, task):
+        if task['image_name'] == '':
+            return ''
+
+        entry = get_prohui_entry_by_date(task['wp_root_dir'], task['image_date'], task['idate_delta'])
+        if entry is not None and is_same_wallpaper(entry.name, task['image_name']):
+            return entry.url
+
+        return get_wallpaper_url_prohui(task['image_name'])
+
+    def fetch(self, task, image_url):
+        try:
+            return download_to_file(image_url, task['image_name'], ImageStreamValidator(IMAGE_HEIGHT))
+        except Exception as e:
+            logger.error("download image from prohui error: %s" % str(e))
+            return False
+
+
+PROVIDERS = [BingProvider(), IoliuProvider(), LocalProvider(), ProhuiProvider()]   # 默认优先级
 
-def download_assign_one_wallpaper(idate_delta, wp_root_dir):
+
+def order_providers(idate_delta, wp_root_dir):
+    """
+    按照历史成功率和耗时给来源排序，没有统计数据时使用默认优先级
+    1、日期间隔
+    2、图片存放地址
+    """
+
+    providers = dict((provider.name, provider) for provider in PROVIDERS)
+    names = open_source_stats(wp_root_dir).order([provider.name for provider in PROVIDERS], idate_delta)
+    return [providers[name] for name in names]
+
+
+def download_assign_one_wallpaper(idate_delta, wp_root_dir, hedge_delay=None):
     """
     下载指定的某一张图片
     1、日期间隔
     2、图片存放地址
-    3、返回失败的图片日期和名称
+    3、对冲下载的等待时间，为None时按顺序逐个尝试各个来源
+    4、返回失败的图片日期和名称
     """
 
     image_date = get_date_from_today_by_delta(idate_delta)
@@ -383,7 +633,7 @@ def download_assign_one_wallpaper(idate_delta, wp_root_dir):
     image_name_bing, image_url_bing, image_date_bing = get_wallpaper_url_bing(wp_root_dir, idate_delta)
     image_name, image_url, image_date = get_wallpaper_url_ioliu(wp_root_dir, idate_delta)
 
-    if image_chk_name != '' and image_name != '' and image_chk_name != image_name:
+    if image_chk_name != '' and image_name != '' and not is_same_wallpaper(image_chk_name, image_name):
         logger.error("The exists wallpaper is wrong on the day: %s" % str(image_date))
         logger.error("image_chk_name := %s; image_name := %s" % (image_chk_name, image_name))
         return image_chk_name, image_date
@@ -393,32 +643,56 @@ def download_assign_one_wallpaper(idate_delta, wp_root_dir):
             logger.warn("the wallpaper existed: %s" % image_chk_name)
             return '', ''
 
-    if image_name_bing != '' and image_name != '' and image_name_bing == image_name:
+    if image_name_bing != '' and image_name != '' and is_same_wallpaper(image_name_bing, image_name):
         judge_down_from_bing = True
     else:
         logger.error("get name from bing and ioliu is different: %s" % image_name)
         judge_down_from_bing = False
 
-    if image_name_bing != '' and judge_down_from_bing:  # 尝试从bing下载最近八日的图片
-        download_one_image(image_name_bing, image_url_bing)
-        if check_download_image(image_name):
-            logger.warn("++==download image from bing success: %s" % image_name)
+    if image_name == '':    # ioliu不可用时使用prohui列表页中的名称
+        entry = get_prohui_entry_by_date(wp_root_dir, image_date, idate_delta)
+        if entry is not None:
+            image_name = wp_root_dir + os.sep + entry.name
+
+    task = {'image_name': image_name,
+            'image_url': image_url,
+            'image_url_bing': image_url_bing,
+            'judge_down_from_bing': judge_down_from_bing,
+            'image_date': image_date,
+            'idate_delta': idate_delta,
+            'wp_root_dir': wp_root_dir}
+
+    if image_name != '':    # 必应哈希相同的图片已经在壁纸目录中时直接复制，不再下载
+        hash_image = find_same_hash_image(wp_root_dir, image_date, image_name)
+        if hash_image != '' and LocalProvider().fetch(task, hash_image):
+            logger.warn("++==copy image with the same bing hash success: %s" % image_name)
             return '', ''
 
-    if image_name != '':
-        download_one_image(image_name, image_url)
-        if check_download_image(image_name):  # 从ioliu下载图片
-            logger.warn("++==download image from ioliu success: %s" % image_name)
-            return '', ''
+    stats = open_source_stats(wp_root_dir)
+    providers = order_providers(idate_delta, wp_root_dir)
 
-    if check_and_copy_exist_image(image_name):  # 尝试从本地保存的文件中拷贝
-        if check_download_image(image_name):
-            logger.warn("++==download image from local success: %s" % image_name)
+    if hedge_delay is not None:     # 对冲下载：网络来源按排序依次并行启动，启动时才获取下载地址
+        candidates = ((provider.name, provider.resolve(task)) for provider in providers if provider.network)
+
+        source = hedged_download(candidates, image_name, hedge_delay,
+                                 lambda: ImageStreamValidator(IMAGE_HEIGHT),
+                                 lambda name, ok, elapsed: stats.record(name, idate_delta, ok, elapsed))
+        if source != '':
+            logger.warn("++==download image from %s success: %s" % (source, image_name))
             return '', ''
 
-    if get_wallpaper_from_prohui(wp_root_dir, idate_delta):
-        if check_download_image(image_name):
-            logger.warn("++==download image from prohui success: %s" % image_name)
+        providers = [provider for provider in providers if not provider.network]
+
+    for provider in providers:
+        provider_url = provider.resolve(task)
+        if provider_url == '':
+            continue
+
+        start_time = time.time()
+        result = provider.fetch(task, provider_url)
+        stats.record(provider.name, idate_delta, result, time.time() - start_time)
+        if result:
+            logger.warn("++==download image from %s success: %s" % (provider.name, image_name))
             return '', ''
 
     return image_name, image_date  # 如果所有的方式都未能获得图片，则返回下载失败的图片信息
@@ -495,14 +769,42 @@ def check_date_format(sdate):
     return True
 
 
-def download_assign_num_wallpaper(dw_count, wp_root_dir):
+def plan_missing_wallpaper(date_deltas, wp_root_dir):
+    """
+    先检查本地已经下载的图片，只有缺失或者损坏的日期才需要访问网络
+    1、 日期间隔列表
+    2、 下载图片的路径
+    3、 返回不需要下载的日期结果和需要下载的日期间隔列表
+    """
+
+    results = {}
+    missing_deltas = []
+    for count in date_deltas:
+        image_date = get_date_from_today_by_delta(count)
+
+        img_chk_count, image_chk_name = chceck_image_exist_by_date(image_date, wp_root_dir)
+        if img_chk_count > 1:       # 如果同一天存在多张则需要手工处理
+            logger.error("exists repeat wallpaper on the day: %s" % str(image_date))
+            results[count] = (image_chk_name, image_date)
+        elif img_chk_count == 1 and check_download_image(image_chk_name):
+            results[count] = ('', '')
+        else:
+            missing_deltas.append(count)
+
+    return results, missing_deltas
+
+
+def download_assign_num_wallpaper(dw_count, wp_root_dir, workers=1, hedge_delay=None):
     """
     下载指定数量的图片
     1、 下载图片的数量
     2、 下载图片的路径
+    3、 并发下载的线程数，为1时逐日下载
+    4、 对冲下载的等待时间，为None时不使用对冲下载
     """
     Fail_image = {}
 
+    date_deltas = []
     count = 0
     while (count < dw_count):
         image_date = get_date_from_today_by_delta(count)
@@ -510,12 +812,57 @@ def download_assign_num_wallpaper(dw_count, wp_root_dir):
         if str(image_date) == '20160304':
             break
 
-        image_name, image_date = download_assign_one_wallpaper(count, wp_root_dir)
+        date_deltas.append(count)
+        count = count + 1
+
+    start_time = time.time()
+
+    results, missing_deltas = plan_missing_wallpaper(date_deltas, wp_root_dir)
+    logger.info('%s of %s days need to download from network.' % (str(len(missing_deltas)), str(len(date_deltas))))
+
+    if workers <= 1:
+        for count in missing_deltas:
+            results[count] = download_assign_one_wallpaper(count, wp_root_dir, hedge_delay)
+            logger.info('The ' + str(count + 1) + ' wallpaper.')
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for count in missing_deltas:
+                future = executor.submit(download_assign_one_wallpaper, count, wp_root_dir, hedge_delay)
+                futures[future] = count
+
+            for future in concurrent.futures.as_completed(futures):
+                count = futures[future]
+                try:
+                    results[count] = future.result()
+                except Exception as e:
+                    logger.error("download wallpaper error: %s" % str(e))
+                    results[count] = ('', get_date_from_today_by_delta(count))
+                logger.info('The ' + str(count + 1) + ' wallpaper.')
+
+    for count in date_deltas:  # 按日期顺序汇总，保证和逐日下载的结果一致
+        image_name, image_date = results[count]
         if str(image_date) != '':
             Fail_image[image_date] = image_name
 
-        count = count + 1
-        logger.info('The ' + str(count) + ' wallpaper.')
+    elapsed = time.time() - start_time
+    logger.info('Processed %s days with %s workers in %.2f s, %.2f days/s.'
+                % (str(len(date_deltas)), str(max(workers, 1)), elapsed,
+                   len(date_deltas) / elapsed if elapsed > 0 else 0.0))
+    log_breaker_summary()
+
+    stats = open_source_stats(wp_root_dir)
+    stats.log_summary()
+    stats.save()
+
+    log_fail_image(Fail_image)
+
+
+def log_fail_image(Fail_image):
+    """
+    输出下载失败的图片列表
+    1、 下载失败的日期和图片名称
+    """
 
     if len(Fail_image) > 0:
         logger.info('===========================================================')
@@ -529,11 +876,12 @@ def download_assign_num_wallpaper(dw_count, wp_root_dir):
             logger.info('[' + str(key) + '] The image name is: ' + str(filename))
 
 
-def download_assign_day_wallpaper(sdate, wp_root_dir):
+def download_assign_day_wallpaper(sdate, wp_root_dir, hedge_delay=None):
     """
     下载指定某一日的图片
     1、 参数为日期，格式参考：20190101 长度为8已判定，年在2010--2020，月和日符合规格，
     2、 下载图片存在的位置
+    3、 对冲下载的等待时间，为None时不使用对冲下载
     """
 
     syear = str(sdate)[0:4]
@@ -547,7 +895,8 @@ def download_assign_day_wallpaper(sdate, wp_root_dir):
 
     date_delta = (d_now - d_old).days
 
-    download_assign_one_wallpaper(date_delta, wp_root_dir)
+    download_assign_one_wallpaper(date_delta, wp_root_dir, hedge_delay)
+    open_source_stats(wp_root_dir).save()
 
 
 def get_every_month_count(syear, wp_root_dir):
@@ -562,21 +911,27 @@ def get_every_month_count(syear, wp_root_dir):
         else:
             smonth = str(imonth)
 
-        sPattern = str(syear) + smonth + '*'
+        sPattern = str(syear) + smonth
 
-        icount, sname = chceck_image_exist_by_date(sPattern, wp_root_dir)
-        logger.info("The number of images in %s is: %s" % (sPattern[0:6], str(icount)))
+        icount = open_library_index(wp_root_dir).count_prefix(sPattern)
+        logger.info("The number of images in %s is: %s" % (sPattern, str(icount)))
 
 
-def download_bing_wallpaper_main(iparam):
+def download_bing_wallpaper_main(iparam, workers=1, hedge_delay=None):
     """
     下载图片的主函数，覆盖所有参数情况
     1、 参数为空，默认下载最近30天
     2、 参数为数字，大于1小于3000, 最近X天以内，否则赋值为1
     3、 具体某一天，字符串长度为8，否则赋值为1
     4、 其他参数提示参数异常需要修改，且只校验第一个参数
+    5、 并发下载的线程数
+    6、 对冲下载的等待时间，为None时按顺序逐个尝试各个来源
     """
 
+    bing_archive.reset()    # 每次运行归档的每一页只请求一次
+    ioliu_list.reset()
+    prohui_list.reset()
+
     sysstr = platform.system()
     if(sysstr == "Windows"):
         user_home = os.environ['HOMEPATH']
@@ -605,9 +960,9 @@ def download_bing_wallpaper_main(iparam):
         dw_count = 15
 
     if dw_count == 0:
-        download_assign_day_wallpaper(iparam, wp_root_dir)
+        download_assign_day_wallpaper(iparam, wp_root_dir, hedge_delay)
     else:
-        download_assign_num_wallpaper(dw_count, wp_root_dir)
+        download_assign_num_wallpaper(dw_count, wp_root_dir, workers, hedge_delay)
 
     now = datetime.datetime.now()
     get_every_month_count(now.year, wp_root_dir)
@@ -622,8 +977,19 @@ if __name__ == '__main__':
     模块调试
     """
 
-    if len(sys.argv) > 1:
-        dw_params = sys.argv[1]
+    parser = argparse.ArgumentParser(description='download bing wallpaper')
+    parser.add_argument('param', nargs='?', default='',
+                        help='number of recent days, or one date like 20190101')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of days downloaded concurrently')
+    parser.add_argument('--hedge-delay', type=float, default=None,
+                        help='seconds to wait for the preferred source before racing the next one')
+    parser.add_argument('--blob-store', default=None,
+                        help='content-addressed store directory, library files become hardlinks to it')
+    args = parser.parse_args()
+
+    if args.param != '':
+        dw_params = args.param
         try:
             dw_params = int(dw_params)
         except Exception as e:
@@ -632,4 +998,5 @@ if __name__ == '__main__':
     else:
         dw_params = ""
 
-    download_bing_wallpaper_main(str(dw_params))
+    set_blob_store(args.blob_store)
+    download_bing_wallpaper_main(str(dw_params), args.workers, args.hedge_delay)
@@ -0,0 +1,461 @@
+#!/bin/python
+#-*- coding:utf-8 -*-
+
+import os
+import sys
+import time
+import asyncio
+import datetime
+import argparse
+import platform
+
+try:
+    import aiohttp
+except ImportError:     # aiohttp为可选依赖，只有异步下载时才需要
+    aiohttp = None
+
+import BingWallpaper
+import common_http
+import common_cache
+from common_logger import Logger
+from common_image import ImageStreamValidator
+from common_identity import is_same_wallpaper
+from common_blobstore import set_blob_store, store_image
+from common_library import library_add, library_remove
+
+"""
+基于asyncio的必应壁纸下载流水线
+1、解析阶段：从必应归档和ioliu获取每一天的图片名称和下载地址
+2、下载阶段：并发下载图片数据
+3、保存阶段：下载时已经边接收边校验，校验通过的图片在线程池中改名写入壁纸目录
+各阶段之间通过有界队列连接，校验和写盘时网络请求不会停止
+"""
+
+logger = Logger('BING_ASYNC')
+
+URL_IOLIU_API = "https://bing.ioliu.cn/v1/"
+URL_IOLIU_PHOTO = "https://bing.ioliu.cn/photo/"
+
+
+class AsyncWallpaperEngine(object):
+    """
+    异步下载引擎，所有的站点地址都可以替换，便于在本地模拟服务器上测试
+    1、图片存放地址
+    2、aiohttp会话
+    3、解析阶段的协程数量
+    4、下载阶段的协程数量
+    5、阶段之间队列的长度
+    """
+
+    def __init__(self, wp_root_dir, session, resolve_workers=4, download_workers=4, queue_size=8,
+                 url_bing=BingWallpaper.URL_BING, url_bing_api=BingWallpaper.URL_BING_API,
+                 url_ioliu_api=URL_IOLIU_API, url_ioliu_photo=URL_IOLIU_PHOTO):
+        self.wp_root_dir = wp_root_dir
+        self.session = session
+        self.resolve_workers = resolve_workers
+        self.download_workers = download_workers
+        self.queue_size = queue_size
+        self.url_bing = url_bing
+        self.url_bing_api = url_bing_api
+        self.url_ioliu_api = url_ioliu_api
+        self.url_ioliu_photo = url_ioliu_photo
+
+        self.bing_images = {}
+        self.bing_pages = set()
+        self.bing_lock = None
+        self.fail_image = {}
+        self.pending = 0
+        self.all_done = None
+
+    async def get_json(self, url, params):
+        """
+        获取接口返回的json数据，失败返回None
+        1、接口地址
+        2、请求参数
+        """
+
+        try:
+            async with self.session.get(url, params=params) as response:
+                if response.status != 200:
+                    logger.error("network error,can not get the wallpaper download url")
+                    return None
+                return await response.json(content_type=None)
+        except Exception as e:
+            logger.error("network error,can not connect the website: %s" % str(e))
+            return None
+
+    async def run_blocking(self, func, *args):
+        """
+        在线程池中执行会阻塞的调用，例如SQLite缓存、目录索引和文件读写，不阻塞其他下载
+        1、调用的函数
+        2、函数的参数
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def get_bing_image(self, image_date, idate_delta):
+        """
+        通过日期获取必应归档中的图片信息，只请求日期所在的那一页，每一页只请求一次
+        1、图片日期
+        2、日期间隔，用于计算所在的页
+        """
+
+        idx = int(idate_delta) // BingWallpaper.BING_ARCHIVE_PAGE * BingWallpaper.BING_ARCHIVE_PAGE
+        async with self.bing_lock:
+            if idx not in self.bing_pages:
+                self.bing_pages.add(idx)
+                payload = {'format': 'js',
+                           'idx': idx,
+                           'n': BingWallpaper.BING_ARCHIVE_PAGE,
+                           'mkt': 'zh-CN'}
+                data = await self.get_json(self.url_bing_api, payload)
+                for image in (data or {}).get("images", []):
+                    self.bing_images.setdefault(image["enddate"], image)
+
+        return self.bing_images.get(image_date)
+
+    async def resolve_one(self, idate_delta):
+        """
+        解析某一天可用的下载地址，返回(图片日期, 图片名称, [下载地址])，无需下载时返回None
+        检查的顺序与BingWallpaper.download_assign_one_wallpaper一致
+        1、日期间隔
+        """
+
+        image_date = BingWallpaper.get_date_from_today_by_delta(idate_delta)
+
+        img_chk_count, image_chk_name = await self.run_blocking(
+            BingWallpaper.chceck_image_exist_by_date, image_date, self.wp_root_dir)
+        if img_chk_count > 1:       # 如果同一天存在多张则需要手工处理
+            logger.error("exists repeat wallpaper on the day: %s" % str(image_date))
+            self.fail_image[image_date] = image_chk_name
+            return None
+
+        image_urls = []
+        image_name = ''
+        metadata_cache = await self.run_blocking(common_cache.open_metadata_cache, self.wp_root_dir)
+
+        cached = await self.run_blocking(metadata_cache.get, 'ioliu', BingWallpaper.MARKET, image_date) \
+            if metadata_cache else None
+        if cached is not None:
+            image_name = self.wp_root_dir + os.sep + cached[0]
+            image_urls.append(cached[1])
+        else:
+            payload = {'type': 'json', 'd': idate_delta, 'w': 1920, 'h': 1080}
+            data = await self.get_json(self.url_ioliu_api, payload)
+            if data is not None and data.get("status", {}).get("code") == 200:
+                image_name, image_url, end_date = BingWallpaper.parse_wallpaper_ioliu(
+                    self.wp_root_dir, data["data"], self.url_ioliu_photo)
+                if image_name != '':
+                    image_urls.append(image_url)
+                if metadata_cache is not None and image_name != '':
+                    await self.run_blocking(metadata_cache.put, 'ioliu', BingWallpaper.MARKET, image_date,
+                                            os.path.basename(image_name), image_url, end_date)
+
+        if idate_delta < BingWallpaper.BING_ARCHIVE_DEPTH:
+            cached = await self.run_blocking(metadata_cache.get, 'bing', BingWallpaper.MARKET, image_date) \
+                if metadata_cache else None
+            if cached is not None:
+                image_name_bing, image_url_bing = self.wp_root_dir + os.sep + cached[0], cached[1]
+            else:
+                image_name_bing, image_url_bing = '', ''
+                image = await self.get_bing_image(image_date, idate_delta)
+                if image is not None:
+                    image_name_bing, image_url_bing, image_date_bing = BingWallpaper.parse_wallpaper_bing(
+                        self.wp_root_dir, image, self.url_bing)
+                    if metadata_cache is not None and image_name_bing != '':
+                        await self.run_blocking(metadata_cache.put, 'bing', BingWallpaper.MARKET, image_date,
+                                                os.path.basename(image_name_bing), image_url_bing, image_date_bing)
+                        if image.get("hsh", '') != '':
+                            await self.run_blocking(metadata_cache.put_hash, BingWallpaper.MARKET, image_date,
+                                                    image["hsh"], image.get("urlbase", ''),
+                                                    os.path.basename(image_name_bing))
+
+            if image_name_bing != '':
+                if image_name != '' and is_same_wallpaper(image_name, image_name_bing):    # 同一张壁纸时优先从必应下载
+                    image_urls.insert(0, image_url_bing)
+                elif image_name == '':
+                    image_name = image_name_bing
+                    image_urls.append(image_url_bing)
+                else:
+                    logger.error("get name from bing and ioliu is different: %s" % image_name)
+
+        if image_chk_name != '' and image_name != '' and not is_same_wallpaper(image_chk_name, image_name):
+            logger.error("The exists wallpaper is wrong on the day: %s" % str(image_date))
+            logger.error("image_chk_name := %s; image_name := %s" % (image_chk_name, image_name))
+            self.fail_image[image_date] = image_chk_name
+            return None
+
+        if image_chk_name != '' and await self.run_blocking(BingWallpaper.check_download_image, image_chk_name):
+            logger.warn("the wallpaper existed: %s" % image_chk_name)
+            return None
+
+        if image_name == '':
+            self.fail_image[image_date] = ''
+            return None
+
+        # 必应哈希相同的图片已经在壁纸目录中时直接复制，不再下载
+        hash_image = await self.run_blocking(
+            BingWallpaper.find_same_hash_image, self.wp_root_dir, image_date, image_name)
+        if hash_image != '' and await self.run_blocking(
+                BingWallpaper.LocalProvider().fetch, {'image_name': image_name}, hash_image):
+            logger.warn("++==copy image with the same bing hash success: %s" % image_name)
+            return None
+
+        return image_date, image_name, image_urls
+
+    async def download_one(self, image_name, image_url):
+        """
+        下载图片数据到临时文件，返回临时文件名称，失败返回''
+        1、图片带路径名称
+        2、下载地址
+        """
+
+        logger.info("++==begin download image: %s" % image_url)
+        temp_name = image_name + '.part'
+        validator = ImageStreamValidator(BingWallpaper.IMAGE_HEIGHT)
+        try:
+            async with self.session.get(image_url) as response:
+                if response.status != 200:
+                    logger.error("download the wallpaper error: %s" % image_url)
+                    return ''
+
+                if response.content_length is not None and 'Content-Encoding' not in response.headers:
+                    validator.content_length = response.content_length
+
+                code = await self.run_blocking(open, temp_name, "wb")
+                try:
+                    async for chunk in response.content.iter_chunked(common_http.DOWNLOAD_CHUNK_SIZE):
+                        validator.feed(chunk)
+                        await self.run_blocking(code.write, chunk)
+                finally:
+                    await self.run_blocking(code.close)
+
+            ok, reason = validator.check(temp_name)
+            if not ok:      # 校验失败的图片不会进入壁纸目录
+                logger.error("the download image is damaged: %s (%s)" % (image_name, reason))
+                await self.run_blocking(os.remove, temp_name)
+                await self.run_blocking(library_remove, temp_name)
+                return ''
+
+            return temp_name
+
+        except Exception as e:
+            logger.error("can not connect website when download: %s" % str(e))
+            if os.path.exists(temp_name):
+                await self.run_blocking(os.remove, temp_name)
+            await self.run_blocking(library_remove, temp_name)
+            return ''
+
+    @staticmethod
+    def commit_one(temp_name, image_name):
+        """
+        将下载时已经校验过的临时文件改名为正式图片，在线程池中执行
+        1、临时文件名称
+        2、图片带路径名称
+        """
+
+        try:
+            os.replace(temp_name, image_name)
+            store_image(image_name)
+            library_add(image_name)
+            return True
+        except Exception as e:
+            logger.error("save the wallpaper error: %s" % str(e))
+            return False
+
+    def finish_one(self):
+        """
+        某一天处理结束，所有日期结束后通知run返回
+        """
+
+        self.pending = self.pending - 1
+        if self.pending == 0:
+            self.all_done.set()
+
+    async def resolve_worker(self, resolve_queue, download_queue):
+        """
+        解析阶段：日期间隔 -> 下载任务
+        """
+
+        while True:
+            idate_delta = await resolve_queue.get()
+            try:
+                job = await self.resolve_one(idate_delta)
+            except Exception as e:
+                logger.error("resolve wallpaper error: %s" % str(e))
+                self.fail_image[BingWallpaper.get_date_from_today_by_delta(idate_delta)] = ''
+                job = None
+            if job is None:
+                self.finish_one()
+            else:
+                await download_queue.put(job)
+            resolve_queue.task_done()
+
+    async def download_worker(self, download_queue, commit_queue):
+        """
+        下载阶段：下载任务 -> 临时文件
+        """
+
+        while True:
+            image_date, image_name, image_urls = await download_queue.get()
+            temp_name = await self.download_one(image_name, image_urls[0])
+            await commit_queue.put((image_date, image_name, image_urls, temp_name))
+            download_queue.task_done()
+
+    async def commit_worker(self, commit_queue, download_queue):
+        """
+        保存阶段：校验临时文件，失败时换下一个地址重新下载
+        """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            image_date, image_name, image_urls, temp_name = await commit_queue.get()
+            if temp_name != '' and await loop.run_in_executor(None, self.commit_one, temp_name, image_name):
+                logger.warn("++==download image success: %s" % image_name)
+                self.finish_one()
+            elif len(image_urls) > 1:   # 换下一个地址重新下载，不阻塞保存阶段
+                asyncio.ensure_future(download_queue.put((image_date, image_name, image_urls[1:])))
+            else:
+                self.fail_image[image_date] = image_name
+                self.finish_one()
+            commit_queue.task_done()
+
+    async def run(self, date_deltas):
+        """
+        下载指定日期间隔的所有图片，返回下载失败的图片信息
+        1、日期间隔列表
+        """
+
+        self.bing_lock = asyncio.Lock()
+        self.all_done = asyncio.Event()
+        self.pending = len(date_deltas)
+        if self.pending == 0:
+            return {}
+
+        resolve_queue = asyncio.Queue()
+        download_queue = asyncio.Queue(self.queue_size)
+        commit_queue = asyncio.Queue(self.queue_size)
+
+        for idate_delta in date_deltas:
+            resolve_queue.put_nowait(idate_delta)
+
+        tasks = []
+        for i in range(self.resolve_workers):
+            tasks.append(asyncio.ensure_future(self.resolve_worker(resolve_queue, download_queue)))
+        for i in range(self.download_workers):
+            tasks.append(asyncio.ensure_future(self.download_worker(download_queue, commit_queue)))
+        tasks.append(asyncio.ensure_future(self.commit_worker(commit_queue, download_queue)))
+
+        await self.all_done.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 按日期顺序输出，与同步下载的结果保持一致
+        return dict((key, self.fail_image[key]) for key in sorted(self.fail_image, reverse=True))
+
+
+async def download_assign_num_wallpaper_async(date_deltas, wp_root_dir, workers=4, **engine_args):
+    """
+    异步下载指定日期间隔的图片，返回下载失败的图片信息
+    1、 日期间隔列表
+    2、 下载图片的路径
+    3、 每个阶段的并发数量
+    4、 传给下载引擎的其他参数，例如替换站点地址
+    """
+
+    connector = aiohttp.TCPConnector(limit_per_host=common_http.HOST_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(sock_connect=common_http.DEFAULT_TIMEOUT[0],
+                                    sock_read=common_http.DEFAULT_TIMEOUT[1])
+    headers = {'User-Agent': common_http.USER_AGENT}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+        engine = AsyncWallpaperEngine(wp_root_dir, session, resolve_workers=workers,
+                                      download_workers=workers, **engine_args)
+        return await engine.run(date_deltas)
+
+
+def download_bing_wallpaper_async_main(iparam, workers=4):
+    """
+    异步下载图片的主函数，参数规则与download_bing_wallpaper_main一致
+    1、 参数为空，默认下载最近15天
+    2、 参数为数字，大于1小于3000, 最近X天以内，否则赋值为1
+    3、 具体某一天，字符串长度为8
+    4、 每个阶段的并发数量
+    """
+
+    if aiohttp is None:
+        logger.error("aiohttp is not installed, please use BingWallpaper.py instead!")
+        return
+
+    sysstr = platform.system()
+    if(sysstr == "Windows"):
+        user_home = os.environ['HOMEPATH']
+    else:
+        user_home = os.environ['HOME']
+
+    wp_root_dir = user_home + os.sep + "Pictures" + os.sep + "必应壁纸"
+    if not os.path.exists(wp_root_dir):
+        os.mkdir(wp_root_dir)
+
+    if iparam != "":
+        if len(iparam) == 8:
+            if not BingWallpaper.check_date_format(iparam):
+                return
+            d_now = datetime.datetime.now()
+            d_now = datetime.datetime(d_now.year, d_now.month, d_now.day)
+            date_deltas = [(d_now - datetime.datetime.strptime(iparam, "%Y%m%d")).days]
+        elif int(iparam) >= 1 and int(iparam) <= 3000:
+            date_deltas = list(range(int(iparam)))
+        else:
+            date_deltas = [0]
+    else:
+        date_deltas = list(range(15))
+
+    date_deltas = [delta for delta in date_deltas
+                   if BingWallpaper.get_date_from_today_by_delta(delta) > '20160304']
+
+    start_time = time.time()
+    Fail_image = {}
+    if len(iparam) != 8:    # 与同步下载一致，多天下载时先跳过本地已经存在的图片
+        results, missing_deltas = BingWallpaper.plan_missing_wallpaper(date_deltas, wp_root_dir)
+        for image_name, image_date in results.values():
+            if str(image_date) != '':
+                Fail_image[image_date] = image_name
+    else:
+        missing_deltas = date_deltas
+
+    Fail_image.update(asyncio.run(download_assign_num_wallpaper_async(missing_deltas, wp_root_dir, workers)))
+    Fail_image = dict((key, Fail_image[key]) for key in sorted(Fail_image, reverse=True))
+    elapsed = time.time() - start_time
+    logger.info('Processed %s days in %.2f s, %.2f days/s.'
+                % (str(len(date_deltas)), elapsed, len(date_deltas) / elapsed if elapsed > 0 else 0.0))
+
+    BingWallpaper.log_fail_image(Fail_image)
+
+    now = datetime.datetime.now()
+    BingWallpaper.get_every_month_count(now.year, wp_root_dir)
+
+
+if __name__ == '__main__':
+    """
+    模块调试
+    """
+
+    parser = argparse.ArgumentParser(description='download bing wallpaper with asyncio')
+    parser.add_argument('param', nargs='?', default='',
+                        help='number of recent days, or one date like 20190101')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of concurrent tasks in each pipeline stage')
+    parser.add_argument('--blob-store', default=None,
+                        help='content-addressed store directory, library files become hardlinks to it')
+    args = parser.parse_args()
+
+    if args.param != '':
+        try:
+            int(args.param)
+        except Exception as e:
+            logger.error("the parameters format not correct, please modify!")
+            sys.exit(0)
+
+    set_blob_store(args.blob_store)
+    download_bing_wallpaper_async_main(args.param, args.workers)
@@ -0,0 +1,335 @@
+#!/bin/python
+#-*- coding:utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import concurrent.futures
+
+import numpy
+
+from common_logger import Logger
+from common_library import list_library_images
+
+"""
+按感知哈希查找整个壁纸目录中的近似重复图片
+1、多进程计算每张图片的dHash和pHash，JPEG使用draft模式在解码时直接缩小，缩放后的计算使用numpy
+2、哈希按(路径, 大小, 修改时间)保存在壁纸目录下，再次运行时只计算有变化的文件
+3、pHash建立BK树，按汉明距离查找相似图片，再用dHash确认，不需要两两比较
+4、输出每组重复图片和可以回收的空间，不删除文件
+"""
+
+logger = Logger('DEDUPE_WP')
+
+PHASH_INDEX_NAME = '.wallpaper_phash.json'
+HASH_SIZE = 8               # 哈希为8x8=64位
+PHASH_SAMPLE_SIZE = 32      # pHash计算DCT的图片大小
+PHASH_THRESHOLD = 6         # pHash汉明距离不超过该值认为相似
+DHASH_THRESHOLD = 10        # dHash汉明距离不超过该值才确认重复
+
+
+def get_dct_matrix(size):
+    """
+    获取一维DCT-II的变换矩阵
+    1、矩阵大小
+    """
+
+    k = numpy.arange(size).reshape(size, 1)
+    n = numpy.arange(size).reshape(1, size)
+    matrix = numpy.cos(numpy.pi * (2 * n + 1) * k / (2.0 * size))
+    matrix[0, :] = matrix[0, :] / numpy.sqrt(2.0)
+    return matrix * numpy.sqrt(2.0 / size)
+
+
+DCT_MATRIX = get_dct_matrix(PHASH_SAMPLE_SIZE)
+
+
+def bits_to_int(bits):
+    """
+    将布尔数组转换为整数
+    1、布尔数组
+    """
+
+    return int(''.join('1' if bit else '0' for bit in bits.flatten()), 2)
+
+
+def hash_one_image(image_path):
+    """
+    计算一张图片的哈希，返回((dHash, pHash), 原因)，失败时哈希为None，在子进程中执行
+    1、图片带路径名称
+    """
+
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as img:
+            img.draft('L', (PHASH_SAMPLE_SIZE * 2, PHASH_SAMPLE_SIZE * 2))     # JPEG解码时按1/2到1/8缩小
+            gray = img.convert('L')
+
+        small = numpy.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=numpy.int16)
+        dhash = bits_to_int(small[:, 1:] > small[:, :-1])
+
+        sample = numpy.asarray(gray.resize((PHASH_SAMPLE_SIZE, PHASH_SAMPLE_SIZE), Image.BILINEAR),
+                               dtype=numpy.float64)
+        dct = DCT_MATRIX.dot(sample).dot(DCT_MATRIX.T)[0:HASH_SIZE, 0:HASH_SIZE]
+        phash = bits_to_int(dct > numpy.median(dct.flatten()[1:]))    # 不包括直流分量
+
+        return (dhash, phash), ''
+
+    except Exception as e:
+        return None, str(e)
+
+
+def hamming_distance(value_a, value_b):
+    """
+    两个哈希的汉明距离
+    1、哈希
+    2、哈希
+    """
+
+    return bin(value_a ^ value_b).count('1')
+
+
+class BKTree(object):
+    """
+    按汉明距离建立的BK树，查找时只进入距离可能满足条件的子树
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        """
+        加入一个哈希
+        1、哈希
+        2、对应的数据
+        """
+
+        self.size = self.size + 1
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            if distance not in current[2]:
+                current[2][distance] = node
+                return
+            current = current[2][distance]
+
+    def search(self, value, radius):
+        """
+        查找汉明距离不超过radius的所有数据，返回[(距离, 数据)]
+        1、哈希
+        2、最大距离
+        """
+
+        if self.root is None:
+            return []
+
+        result = []
+        nodes = [self.root]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= radius:
+                result.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes.append(child)
+
+        return result
+
+
+def load_phash_index(root_dir):
+    """
+    读取保存的哈希索引
+    1、壁纸存放的根目录
+    """
+
+    index_path = os.path.join(root_dir, PHASH_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return {}
+
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error("load the perceptual hash index error: %s" % str(e))
+        return {}
+
+
+def save_phash_index(root_dir, phash_index):
+    """
+    保存哈希索引
+    1、壁纸存放的根目录
+    2、相对路径 -> [大小, 修改时间, dHash, pHash]
+    """
+
+    try:
+        with open(os.path.join(root_dir, PHASH_INDEX_NAME), 'w', encoding='utf-8') as f:
+            json.dump(phash_index, f)
+    except Exception as e:
+        logger.error("save the perceptual hash index error: %s" % str(e))
+
+
+def hash_library(root_dirs, workers=None):
+    """
+    计算多个壁纸目录中所有图片的哈希，返回[(带路径名称, 大小, dHash, pHash)]
+    1、壁纸存放的根目录列表
+    2、并发计算的进程数，默认为CPU数量
+    """
+
+    hashes = []
+    to_hash = []
+    indexes = {}
+    cached_count = 0
+    failed_count = 0
+    for root_dir in root_dirs:
+        old_index = load_phash_index(root_dir)
+        indexes[root_dir] = {}
+        for rel_path, size, mtime in list_library_images(root_dir):
+            cached = old_index.get(rel_path)
+            if cached is not None and cached[0] == size and cached[1] == mtime:
+                indexes[root_dir][rel_path] = cached
+                hashes.append((os.path.join(root_dir, rel_path), size, cached[2], cached[3]))
+                cached_count = cached_count + 1
+            else:
+                to_hash.append((root_dir, rel_path, size, mtime))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        paths = [os.path.join(root_dir, rel_path) for root_dir, rel_path, size, mtime in to_hash]
+        results = executor.map(hash_one_image, paths, chunksize=16)
+        for (root_dir, rel_path, size, mtime), (result, reason) in zip(to_hash, results):
+            if result is None:
+                logger.error("can not hash the image: %s (%s)" % (rel_path, reason))
+                failed_count = failed_count + 1
+                continue
+            indexes[root_dir][rel_path] = [size, mtime, result[0], result[1]]
+            hashes.append((os.path.join(root_dir, rel_path), size, result[0], result[1]))
+
+    for root_dir in root_dirs:
+        save_phash_index(root_dir, indexes[root_dir])
+
+    logger.info("Hashed %s images, cached: %s, failed: %s"
+                % (str(len(to_hash) - failed_count), str(cached_count), str(failed_count)))
+    return hashes
+
+
+def find_duplicates(hashes, phash_threshold=PHASH_THRESHOLD, dhash_threshold=DHASH_THRESHOLD):
+    """
+    查找近似重复的图片，返回按文件名排序的分组列表[[(带路径名称, 大小)]]，只包含两张以上的分组
+    1、[(带路径名称, 大小, dHash, pHash)]
+    2、pHash的最大汉明距离
+    3、dHash的最大汉明距离
+    """
+
+    tree = BKTree()
+    for index, item in enumerate(hashes):
+        tree.add(item[3], index)
+
+    parents = list(range(len(hashes)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for index, item in enumerate(hashes):
+        for distance, other in tree.search(item[3], phash_threshold):
+            if other != index and hamming_distance(item[2], hashes[other][2]) <= dhash_threshold:
+                parents[find(other)] = find(index)
+
+    groups = {}
+    for index, item in enumerate(hashes):
+        groups.setdefault(find(index), []).append((item[0], item[1]))
+
+    return sorted([sorted(group) for group in groups.values() if len(group) > 1])
+
+
+def get_reclaimable_bytes(group):
+    """
+    一组重复图片中保留最大的一张，其余可以回收的字节数，硬链接到同一个文件的不重复计算
+    1、[(带路径名称, 大小)]
+    """
+
+    keep_path, keep_size = max(group, key=lambda item: item[1])
+    inodes = set([(os.stat(keep_path).st_dev, os.stat(keep_path).st_ino)])
+
+    reclaimable = 0
+    for image_path, size in group:
+        st = os.stat(image_path)
+        if (st.st_dev, st.st_ino) not in inodes:
+            inodes.add((st.st_dev, st.st_ino))
+            reclaimable = reclaimable + size
+
+    return reclaimable
+
+
+def dedupe_library(root_dirs, workers=None, phash_threshold=PHASH_THRESHOLD):
+    """
+    查找并输出多个壁纸目录中的近似重复图片，返回(分组列表, 可以回收的字节数)
+    1、壁纸存放的根目录列表
+    2、并发计算的进程数，默认为CPU数量
+    3、pHash的最大汉明距离
+    """
+
+    start_time = time.time()
+
+    hashes = hash_library(root_dirs, workers)
+    groups = find_duplicates(hashes, phash_threshold)
+
+    total_reclaimable = 0
+    for group in groups:
+        reclaimable = get_reclaimable_bytes(group)
+        total_reclaimable = total_reclaimable + reclaimable
+        logger.warn("duplicate images, %.1f MB reclaimable:" % (reclaimable / 1048576.0))
+        for image_path, size in group:
+            logger.warn("    %s (%s bytes)" % (image_path, str(size)))
+
+    elapsed = time.time() - start_time
+    logger.info("File Count: %s, duplicate groups: %s, reclaimable: %.1f MB, in %.2f s"
+                % (str(len(hashes)), str(len(groups)), total_reclaimable / 1048576.0, elapsed))
+
+    return groups, total_reclaimable
+
+
+if __name__ == '__main__':
+    """
+    模块调试
+    """
+
+    sysstr = platform.system()
+    if(sysstr == "Windows"):
+        user_home = os.environ['HOMEPATH']
+    else:
+        user_home = os.environ['HOME']
+
+    pictures_dir = user_home + os.sep + "Pictures"
+
+    parser = argparse.ArgumentParser(description='find near-duplicate wallpapers by perceptual hash')
+    parser.add_argument('root_dirs', nargs='*',
+                        default=[pictures_dir + os.sep + "必应壁纸", pictures_dir + os.sep + "品汇壁纸"],
+                        help='wallpaper directories to check')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of hashing processes, default is the cpu count')
+    parser.add_argument('--threshold', type=int, default=PHASH_THRESHOLD,
+                        help='max pHash hamming distance of near-duplicate images')
+    args = parser.parse_args()
+
+    root_dirs = [root_dir for root_dir in args.root_dirs if os.path.isdir(root_dir)]
+    if len(root_dirs) == 0:
+        logger.error("the wallpaper directory not exists: %s" % ', '.join(args.root_dirs))
+        sys.exit(0)
+
+    dedupe_library(root_dirs, args.workers, args.threshold)
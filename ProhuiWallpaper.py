@@ -5,18 +5,22 @@ import os
 import re
 import sys
 import time
-import random
 import datetime
 import argparse
-import urllib.request
-import requests
 import platform
 import shutil
-import glob
+import collections
+import concurrent.futures
 
-from PIL import Image
-from lxml import etree
 from common_logger import Logger
+from common_library import open_library_index, library_remove
+from common_pagecache import open_page_cache
+from common_identity import is_same_wallpaper
+from common_prohui import URL_HUI_BASE, parse_prohui_listing, record_prohui_entries, get_prohui_entry_by_date
+from common_image import probe_image_size, check_image_file, ImageStreamValidator
+from VerifyWallpaper import verify_library
+from common_blobstore import set_blob_store
+from common_http import get_url_content, get_remote_size, download_to_file
 
 """
 http://www.prohui.com/wallpaper/OHR.SpringBadlands_ZH-CN8280871661_1920x1080.jpg
@@ -26,7 +30,7 @@ https://www.prohui.com/plugin.php?id=mini_download:index&c=14&types=time&page=2
 
 logger = Logger('HUI_WP')
 
-URL_HUI_BASE = 'https://www.prohui.com/plugin.php?id=mini_download:index&c=14&types=time&page=%s'
+IMAGE_HEIGHT = 1080     # 壁纸图片要求的高度
 
 
 def get_date_from_today_by_delta(idate_delta):
@@ -92,23 +96,16 @@ def check_download_image(image_dir):
         return False
 
     try:
-        img = Image.open(image_dir)
-        imgSize = img.size       # 图片尺寸
-        imgwd = img.width        # 图片的宽
-        imght = img.height       # 图片的高
-        imgft = img.format       # 图像格式
-
-        logger.info("the download file size: %s" % str(imgSize))
-        logger.info("the image file width: %s" % str(imgwd))
-        logger.info("the file height: %s" % str(imght))
-        logger.info("the file format: %s" % str(imgft))
-
-        if int(imght) != 1080:
+        imgwd, imght, imgft = probe_image_size(image_dir)     # 图片的宽、高和格式
+
+        logger.debug("the image file size: %s x %s %s" % (str(imgwd), str(imght), str(imgft)))
+
+        if int(imght) != IMAGE_HEIGHT:
             try:
                 if os.path.exists(image_dir):
                     os.remove(image_dir)
+                    library_remove(image_dir)
                     logger.info("the damaged file is delete: %s" % str(image_dir))
-                    time.sleep(0.1)
             except Exception as e:
                 pass
 
@@ -122,8 +119,8 @@ def check_download_image(image_dir):
         try:
             if os.path.exists(image_dir):
                 os.remove(image_dir)
+                library_remove(image_dir)
                 logger.info("the damaged file is delete: %s" % str(image_dir))
-                time.sleep(0.1)
         except Exception as e:
             pass
 
@@ -149,17 +146,11 @@ def list_all_files(rootdir):
 
 def test_check_image(root_dir):
     """
-    开始下载指定的某一张图片并保存
-    1、图片带路径名称
-    2、和下载地址
+    检查整个目录的图片，删除有问题的图片，参考VerifyWallpaper.py
+    1、图片存放的根目录
     """
 
-    all_files = list_all_files(root_dir)
-    for i in range(0, len(all_files)):
-        image_path = all_files[i]
-        check_download_image(image_path)
-
-    logger.info("File Count: %s" % str(i))
+    verify_library(root_dir)
 
 
 def download_one_image(image_path_name, image_url):
@@ -171,15 +162,7 @@ def download_one_image(image_path_name, image_url):
 
     logger.info("++==begin download image: %s" % image_url)
     try:
-        response = requests.get(image_url)
-        if response.status_code != 200:
-            logger.error("download the wallpaper error: %s" % image_url)
-            return False
-
-        with open(image_path_name, "wb") as code:
-            code.write(response.content)
-
-        return True
+        return download_to_file(image_url, image_path_name, ImageStreamValidator(IMAGE_HEIGHT))
 
     except Exception as e:
         logger.error("can not connect website when download: %s" % str(e))
@@ -193,187 +176,147 @@ def chceck_image_exist_by_date(image_date, wp_root_dir):
     2、图片下载存在根目录
     """
 
-    img_pattern_path = wp_root_dir + os.sep + str(image_date) + '_*.jpg'
-
-    match_image = glob.glob(img_pattern_path)
-    iCount = len(match_image)
-    if iCount > 0:
-        image_name = match_image[0]
-    else:
-        image_name = ''
+    return open_library_index(wp_root_dir).find(image_date)
 
-    # print(iCount, image_name)
-    return iCount, image_name
 
-
-def download_all_prohui_wallpaper(url, wp_root_dir):
+def parse_prohui_page(content, wp_root_dir, replace=True):
     '''
-    从prohui网站下载所有的bing壁纸
-    1、prohui网站爬取基地址
+    解析prohui网站的一页壁纸列表并记录到元数据缓存，返回[(图片日期, 下载地址, 图片带路径名称)]
+    1、页面内容
     2、保存图片的根目录
+    3、是否覆盖元数据缓存中已有的日期
     '''
 
-    headers = ["Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36"
-               " (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36",
-               "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.36"
-               " (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36",
-               "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:30.0) Gecko/20100101 Firefox/30.0"
-               "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.75.14"
-               " (KHTML, like Gecko) Version/7.0.3 Safari/537.75.14",
-               "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2; Win64; x64; Trident/6.0)"]
-
-    randdom_header = random.choice(headers)
-    req = urllib.request.Request(url)
-    req.add_header("User-Agent", randdom_header)
-    content = urllib.request.urlopen(req).read()
-    html = etree.HTML(content)  # 初始化生成一个XPath解析对象
-    # result = etree.tostring(html, encoding='utf-8')  # 解析对象输出代码
-    links = html.xpath('//ul[@class="appList"]/li[@class="item"]')
-    # print(type(html))
-    # print(type(result))
-    # print(len(result))
-    # print(result)
-    # print(result[0][0][0][0][0])
-
-    # for item in links:
-    #     print(item.attrib)
-    #     print(item.tag)
-    #     print(item.text)
-    # print('当前页面壁纸数量：', len(links))
-    wp_count = len(links)
-    for index in range(wp_count):
-        # links[index]返回的是一个字典
-        # if (index % 2) == 0:
-        # print(type(links[index]))
-        # print(links[index].tag)
-        # print(links[index].attrib)
-        # print(links[index].text)
-
-        result1 = links[index].xpath('./a/div/span[@class="z"]')
-        # print(result1[0].text.strip())
-        # for item in result:
-        #     #print(item.attrib)
-        #     #print(item.tag)
-        #     print(item.text)
-
-        result2 = links[index].xpath('./a/img')
-        #print(result1[0].text.strip()[0:10], '==', result2[0].attrib['src'].strip())
-        # for item in result:
-        #     print(item.attrib)
-        #     #print(item.tag)
-        #     #print(item.text)
-        image_date = result1[0].text.strip()[0:10].replace('-', '')
-        image_url = result2[0].attrib['src'].strip().replace('/w/500', '/w/1920').replace('/h/284', '/h/1080')
-        print(image_url)
+    entries = parse_prohui_listing(content)
+    record_prohui_entries(wp_root_dir, entries, replace)
+    return [(entry.date, entry.url, wp_root_dir + os.sep + entry.name) for entry in entries]
 
-        name_index_start = len("http://cdn.prohui.com/wallpaper/")
-        name_index_endin = image_url.index("?imageView2")
-        str_pic_name = image_url[name_index_start:name_index_endin]
 
-        image_name = wp_root_dir + os.sep + image_date + '_' + str_pic_name
+def is_local_image_current(image_url, image_name):
+    '''
+    通过HEAD请求的Content-Length检查本地图片和网站上的是否一致，获取不到大小时认为一致
+    1、图片的链接地址
+    2、图片带路径名称
+    '''
 
-        image_name = image_name.replace('OHR.', '')
-        image_name = image_name.replace('_1920x1080', '')
-        image_name = image_name.replace('_1080x1920', '')
+    remote_size = get_remote_size(image_url)
+    if remote_size is None:
+        return True
 
-        print(image_name)
+    local_size = os.path.getsize(image_name)
+    if local_size != remote_size:
+        logger.info("the local image size %s differs from remote %s: %s"
+                    % (str(local_size), str(remote_size), image_name))
+        return False
 
-        randdom_header = random.choice(headers)
-        req = urllib.request.Request(image_url)
-        req.add_header("User-Agent", randdom_header)
-        content = urllib.request.urlopen(req).read()
+    return True
 
-        try:
-            with open(image_name, "wb") as code:
-                code.write(content)
 
-        except Exception as e:
-            logger.error("download image from prohui error: %s" % str(e))
+def is_local_image_valid(image_name):
+    '''
+    检查本地已有的图片是否完整，只读取文件的头部和尾部，不删除文件
+    1、图片带路径名称
+    '''
 
+    ok, reason = check_image_file(image_name, IMAGE_HEIGHT)
+    if not ok:
+        logger.info("the local image is damaged, download it again: %s (%s)" % (image_name, reason))
 
-def get_prohui_wpurl_by_index(page_index):
+    return ok
+
+
+def download_prohui_image(image_url, image_name, check_remote=False):
     '''
-    从prohui网站获取指定页面的下载地址
-    1、指定页面的索引    
+    下载prohui网站的一张壁纸并校验，成功返回True，本地已有相同的图片时返回False
+    1、图片的链接地址
+    2、图片带路径名称
+    3、本地的图片完整时检查和网站上的大小是否一致，不一致才重新下载
     '''
 
-    headers = ["Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36"
-               " (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36",
-               "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.36"
-               " (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36",
-               "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:30.0) Gecko/20100101 Firefox/30.0"
-               "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.75.14"
-               " (KHTML, like Gecko) Version/7.0.3 Safari/537.75.14",
-               "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2; Win64; x64; Trident/6.0)"]
+    try:
+        if check_remote and os.path.exists(image_name) and is_local_image_current(image_url, image_name):
+            return False
 
-    url_hui = URL_HUI_BASE % str(page_index)
+        return download_to_file(image_url, image_name, ImageStreamValidator(IMAGE_HEIGHT))
 
-    randdom_header = random.choice(headers)
-    req = urllib.request.Request(url_hui)
-    req.add_header("User-Agent", randdom_header)
-    content = urllib.request.urlopen(req).read()
-    html = etree.HTML(content)  # 初始化生成一个XPath解析对象
-    result = etree.tostring(html, encoding='utf-8')  # 解析对象输出代码
-    links = html.xpath('//ul[@class="appList"]/li[@class="item"]')
-    wp_count = len(links)
-    print('当前页面壁纸数量：', wp_count)
-    for index in range(wp_count):
-        result1 = links[index].xpath('./a/div/span[@class="z"]')
-        result2 = links[index].xpath('./a/img')
-        print(result1[0].text.strip()[0:10], '==', result2[0].attrib['src'].strip())
-
-        image_date = result1[0].text.strip()[0:10].replace('-', '')
-        image_url = result2[0].attrib['src'].strip().replace('/w/500', '/w/1920').replace('/h/284', '/h/1080')
-        print(image_url)
+    except Exception as e:
+        logger.error("download image from prohui error: %s" % str(e))
+        return False
 
-        name_index_start = len("http://cdn.prohui.com/wallpaper/")
-        name_index_endin = image_url.index("?imageView2")
-        str_pic_name = image_url[name_index_start:name_index_endin]
 
-        image_name = image_date + '_' + str_pic_name
+def fetch_prohui_page(page_index, wp_root_dir):
+    '''
+    从prohui网站获取一页壁纸列表，并保存到页面缓存
+    1、页码
+    2、保存图片的根目录
+    '''
 
-        image_name = image_name.replace('OHR.', '')
-        image_name = image_name.replace('_1920x1080', '')
-        image_name = image_name.replace('_1080x1920', '')
+    content = get_url_content(URL_HUI_BASE % str(page_index))
+    open_page_cache(wp_root_dir, 'prohui').put(page_index, content)
+    return content
 
-        print(image_name)
 
+def download_all_prohui_wallpaper(url, wp_root_dir, incremental=False, seen=None, content=None, check_remote=False):
+    '''
+    从prohui网站下载所有的bing壁纸，返回(页面中的壁纸数量, 本地还没有的壁纸数量)
+    1、prohui网站爬取基地址
+    2、保存图片的根目录
+    3、增量同步，某一页有壁纸并且全部是本地已有的完整壁纸时由调用者停止
+    4、本次已经处理过的图片，图片名称 -> 是否下载成功，重名的图片只下载第一张
+    5、已经获取的页面内容，为None时从网站获取
+    6、本地已有的完整壁纸和网站上的大小比较，不一致时重新下载，否则直接跳过，增量同步时同样检查
+    '''
 
-def get_wallpaper_from_prohui(wp_root_dir, idate_delta):
-    """
-    获取ioliu下载指定的某一张图片的地址，
-    1、图片存放地址
-    2、日期间隔
-    """
+    if content is None:
+        content = get_url_content(url)
 
-    URL_HUI = 'http://cdn.prohui.com/wallpaper/OHR.'
+    entry_count = 0
+    new_count = 0
+    library_index = open_library_index(wp_root_dir)
+    for image_date, image_url, image_name in parse_prohui_page(content, wp_root_dir):
+        entry_count = entry_count + 1
+        if seen is not None:
+            if image_name in seen:
+                continue
+            seen[image_name] = False
 
-    image_name, image_url, image_date = get_wallpaper_url_ioliu(wp_root_dir, idate_delta)
+        print(image_url)
+        print(image_name)
 
-    if image_name == '':
-        return False
+        existing = library_index.exists(image_name) and is_local_image_valid(image_name)
+        if not existing:
+            new_count = new_count + 1
+        elif not check_remote:
+            continue
 
-    mini_image_name = image_name.split("\\")
-    mini_image_name = mini_image_name[len(mini_image_name) - 1]
-    mini_image_name = mini_image_name[9:-4]
+        ok = download_prohui_image(image_url, image_name, existing)   # 本地图片完整时先比较网站上的大小
+        if seen is not None:
+            seen[image_name] = ok
 
-    image_url_hui = URL_HUI + mini_image_name + '_1920x1080.jpg'
+    return entry_count, new_count
 
-    try:
-        picture_data = get_url_content(image_url_hui)
-        with open(image_name, "wb") as code:
-            code.write(picture_data)
 
-    except Exception as e:
-        logger.error("download image from prohui error: %s" % str(e))
-        return False
+def get_prohui_wpurl_by_index(page_index):
+    '''
+    从prohui网站获取指定页面的下载地址，返回[ProhuiEntry]
+    1、指定页面的索引
+    '''
 
-    return True
+    url_hui = URL_HUI_BASE % str(page_index)
+
+    content = get_url_content(url_hui)
+    entries = parse_prohui_listing(content)
+    print('当前页面壁纸数量：', len(entries))
+    for entry in entries:
+        print(entry.date, '==', entry.url)
+        print(entry.name)
+
+    return entries
 
 
 def download_assign_one_wallpaper(idate_delta, wp_root_dir):
     """
-    下载指定的某一张图片
+    下载指定的某一张图片，名称和下载地址来自prohui的列表页
     1、日期间隔
     2、图片存放地址
     3、返回失败的图片日期和名称
@@ -386,10 +329,10 @@ def download_assign_one_wallpaper(idate_delta, wp_root_dir):
         logger.error("exists repeat wallpaper on the day: %s" % str(image_date))
         return image_chk_name, image_date
 
-    image_name_bing, image_url_bing, image_date_bing = get_wallpaper_url_bing(wp_root_dir, idate_delta)
-    image_name, image_url, image_date = get_wallpaper_url_ioliu(wp_root_dir, idate_delta)
+    entry = get_prohui_entry_by_date(wp_root_dir, image_date, idate_delta)
+    image_name = wp_root_dir + os.sep + entry.name if entry is not None else ''
 
-    if image_chk_name != '' and image_name != '' and image_chk_name != image_name:
+    if image_chk_name != '' and image_name != '' and not is_same_wallpaper(image_chk_name, image_name):
         logger.error("The exists wallpaper is wrong on the day: %s" % str(image_date))
         logger.error("image_chk_name := %s; image_name := %s" % (image_chk_name, image_name))
         return image_chk_name, image_date
@@ -399,28 +342,13 @@ def download_assign_one_wallpaper(idate_delta, wp_root_dir):
             logger.warn("the wallpaper existed: %s" % image_chk_name)
             return '', ''
 
-    if image_name_bing != '' and image_name != '' and image_name_bing == image_name:
-        judge_down_from_bing = True
-    else:
-        logger.error("get name from bing and ioliu is different: %s" % image_name)
-        judge_down_from_bing = False
+    if entry is None:
+        logger.error("can not find the wallpaper in prohui: %s" % str(image_date))
+        return '', image_date
 
-    if image_name_bing != '' and judge_down_from_bing:  # 尝试从bing下载最近八日的图片
-        download_one_image(image_name_bing, image_url_bing)
-        if check_download_image(image_name):
-            logger.warn("++==download image from bing success: %s" % image_name)
-            return '', ''
-
-    if image_name != '':
-        download_one_image(image_name, image_url)
-        if check_download_image(image_name):  # 从ioliu下载图片
-            logger.warn("++==download image from ioliu success: %s" % image_name)
-            return '', ''
-
-    if get_wallpaper_from_prohui(wp_root_dir, idate_delta):
-        if check_download_image(image_name):
-            logger.warn("++==download image from prohui success: %s" % image_name)
-            return '', ''
+    if download_one_image(image_name, entry.url):
+        logger.warn("++==download image from prohui success: %s" % image_name)
+        return '', ''
 
     return image_name, image_date  # 如果所有的方式都未能获得图片，则返回下载失败的图片信息
 
@@ -563,19 +491,26 @@ def get_every_month_count(syear, wp_root_dir):
         else:
             smonth = str(imonth)
 
-        sPattern = str(syear) + smonth + '*'
+        sPattern = str(syear) + smonth
 
-        icount, sname = chceck_image_exist_by_date(sPattern, wp_root_dir)
-        logger.info("The number of images in %s is: %s" % (sPattern[0:6], str(icount)))
+        icount = open_library_index(wp_root_dir).count_prefix(sPattern)
+        logger.info("The number of images in %s is: %s" % (sPattern, str(icount)))
 
 
-def download_prohui_wallpaper_main(iparam):
+def download_prohui_wallpaper_main(iparam, incremental=True, page_workers=1, image_workers=1, offline=False,
+                                   check_remote=False, prune_cache=False):
     """
     下载图片的主函数，覆盖所有参数情况
     1、 参数为空，默认下载最近30天
     2、 参数为数字，大于1小于3000, 最近X天以内，否则赋值为1
     3、 具体某一天，字符串长度为8，否则赋值为1
     4、 其他参数提示参数异常需要修改，且只校验第一个参数
+    5、 增量同步，遇到全部已经下载的页面后停止
+    6、 同时请求的列表页数量
+    7、 并发下载图片的线程数
+    8、 离线模式，只重新解析缓存的列表页，不删除缓存
+    9、 本地已有的壁纸和网站上的大小比较，不一致时重新下载
+    10、离线模式下删除没有补充任何壁纸的旧页面内容
     """
 
     sysstr = platform.system()
@@ -588,6 +523,10 @@ def download_prohui_wallpaper_main(iparam):
     if not os.path.exists(wp_root_dir):
         os.mkdir(wp_root_dir)
 
+    if offline:
+        reparse_prohui_cache(wp_root_dir, prune_cache)
+        return
+
     if iparam != "":
         if int(iparam) > 0:
             if len(iparam) != 8:
@@ -610,7 +549,7 @@ def download_prohui_wallpaper_main(iparam):
     # else:
     #     download_assign_num_wallpaper(dw_count, wp_root_dir)
 
-    get_all_prohui_wallpaper_url(wp_root_dir)
+    get_all_prohui_wallpaper_url(wp_root_dir, incremental, page_workers, image_workers, check_remote)
 
     now = datetime.datetime.now()
     get_every_month_count(now.year, wp_root_dir)
@@ -620,10 +559,14 @@ def download_prohui_wallpaper_main(iparam):
     # get_every_month_count('2019', wp_root_dir)
 
 
-def get_all_prohui_wallpaper_url(wp_root_dir):
+def get_all_prohui_wallpaper_url(wp_root_dir, incremental=False, page_workers=1, image_workers=1, check_remote=False):
     """
     获取所有的prohui网站壁纸下载地址
-    1、 参数为空
+    1、 保存图片的根目录
+    2、 增量同步，页面按时间从新到旧排列，某一页有壁纸并且全部是本地已有的完整壁纸时停止
+    3、 同时请求的列表页数量
+    4、 并发下载图片的线程数
+    5、 本地已有的壁纸和网站上的大小比较，不一致时重新下载
     """
     now = datetime.datetime.now()
     interval_dates = get_delta_from_today_by_date('20150512')
@@ -631,38 +574,198 @@ def get_all_prohui_wallpaper_url(wp_root_dir):
     imax_page = (interval_dates // 14) + 1
     imax_page = 131
     # print(imax_page)
+
+    if page_workers > 1 or image_workers > 1:
+        crawl_prohui_pages(wp_root_dir, imax_page, incremental, page_workers, image_workers, check_remote)
+        return
+
+    start_time = time.time()
+    seen = {}
+    page_count = 0
     for ipage in range(1, imax_page + 1):
         url_hui = URL_HUI_BASE % str(ipage)
         # print(url_hui)
-        download_all_prohui_wallpaper(url_hui, wp_root_dir)
+        try:
+            content = fetch_prohui_page(ipage, wp_root_dir)
+        except Exception as e:      # 和并发爬取一致，某一页失败时跳过该页
+            logger.error("get the prohui page %s error: %s" % (str(ipage), str(e)))
+            continue
+
+        entry_count, new_count = download_all_prohui_wallpaper(url_hui, wp_root_dir, incremental, seen, content,
+                                                               check_remote)
+        page_count = page_count + 1
+        if entry_count == 0:        # 页面格式变化或者内容不完整时不能判断是否已经同步完
+            logger.warn("page %s has no wallpaper, continue with the next page" % str(ipage))
+        elif incremental and new_count == 0:
+            logger.info("page %s has no new wallpaper, stop syncing" % str(ipage))
+            break
 
+    image_count = len([image_name for image_name in seen if seen[image_name]])
+    log_crawl_speed(page_count, image_count, time.time() - start_time)
 
-if __name__ == '__main__':
+
+def crawl_prohui_pages(wp_root_dir, imax_page, incremental=False, page_workers=4, image_workers=4,
+                       check_remote=False):
     """
-    模块调试
+    并发爬取prohui网站：列表页和图片分别在两个线程池中下载，解析和下载同时进行
+    页面按顺序解析，重名的图片只下载第一张，得到的文件和逐页下载完全相同
+    1、 保存图片的根目录
+    2、 最大页数
+    3、 增量同步，某一页有壁纸并且全部是本地已有的完整壁纸时停止，已经发出的后续页面请求会被丢弃
+    4、 同时请求的列表页数量
+    5、 并发下载图片的线程数
+    6、 本地已有的壁纸和网站上的大小比较，不一致时重新下载
     """
 
-    sysstr = platform.system()
-    if(sysstr == "Windows"):
-        user_home = os.environ['HOMEPATH']
-    else:
-        user_home = os.environ['HOME']
+    start_time = time.time()
+    library_index = open_library_index(wp_root_dir)
 
-    wp_root_dir = user_home + os.sep + "Pictures" + os.sep + "品汇壁纸"
+    seen = set()
+    page_count = 0
+    image_futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(page_workers, 1)) as page_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(image_workers, 1)) as image_executor:
+        pending = collections.deque()
+        next_page = 1
+        while True:
+            while next_page <= imax_page and len(pending) < max(page_workers, 1):
+                pending.append((next_page, page_executor.submit(fetch_prohui_page, next_page, wp_root_dir)))
+                next_page = next_page + 1
 
-    get_every_month_count('2015', wp_root_dir)
-    get_every_month_count('2016', wp_root_dir)
-    get_every_month_count('2017', wp_root_dir)
-    get_every_month_count('2018', wp_root_dir)
-    get_every_month_count('2019', wp_root_dir)
+            if len(pending) == 0:
+                break
 
-    sys.exit(0)
+            ipage, future = pending.popleft()
+            try:
+                content = future.result()
+            except Exception as e:
+                logger.error("get the prohui page %s error: %s" % (str(ipage), str(e)))
+                continue
+
+            page_count = page_count + 1
+            entry_count = 0
+            new_count = 0
+            for image_date, image_url, image_name in parse_prohui_page(content, wp_root_dir):
+                entry_count = entry_count + 1
+                if image_name in seen:
+                    continue
+                seen.add(image_name)
+
+                existing = library_index.exists(image_name) and is_local_image_valid(image_name)
+                if not existing:
+                    new_count = new_count + 1
+                elif not check_remote:
+                    continue
+
+                image_futures.append(image_executor.submit(download_prohui_image, image_url, image_name, existing))
+
+            if entry_count == 0:
+                logger.warn("page %s has no wallpaper, continue with the next page" % str(ipage))
+            elif incremental and new_count == 0:
+                logger.info("page %s has no new wallpaper, stop syncing" % str(ipage))
+                for ipage, future in pending:
+                    future.cancel()
+                pending.clear()
+                next_page = imax_page + 1
+
+    image_count = len([future for future in image_futures if future.result()])
+    log_crawl_speed(page_count, image_count, time.time() - start_time)
+
+
+def reparse_prohui_cache(wp_root_dir, prune=False):
+    """
+    离线重新解析缓存的列表页，不访问网站，返回[(图片日期, 下载地址, 图片带路径名称)]
+    先按页码顺序解析每页最新的内容，和在线爬取的结果一致，再补充只在旧内容中出现的壁纸，
+    例如增量同步后从已刷新的页面移到未刷新页面的壁纸，重名的图片只保留第一张。
+    旧内容只补充元数据缓存中还没有的日期。默认不删除任何缓存
+    1、 保存图片的根目录
+    2、 删除没有补充任何壁纸的旧内容，该页最新的内容解析不到壁纸时说明解析有问题，不删除
+    """
+
+    start_time = time.time()
+    library_index = open_library_index(wp_root_dir)
+    page_cache = open_page_cache(wp_root_dir, 'prohui')
+
+    seen = set()
+    entries = []
+
+    def add_entries(content, replace):
+        page_entries = parse_prohui_page(content, wp_root_dir, replace)
+        added = 0
+        for image_date, image_url, image_name in page_entries:
+            if image_name in seen:
+                continue
+            seen.add(image_name)
+            entries.append((image_date, image_url, image_name))
+            added = added + 1
+        return len(page_entries), added
+
+    page_indexes = page_cache.page_indexes()
+    parsed_pages = set()
+    for ipage in page_indexes:
+        content = page_cache.get(ipage)
+        if content is not None and add_entries(content, True)[0] > 0:
+            parsed_pages.add(ipage)
+
+    current_count = len(entries)
+    removed_count = 0
+    for ipage in page_indexes:
+        for content_hash in page_cache.old_hashes(ipage):
+            content = page_cache.get(ipage, content_hash)
+            if content is not None and add_entries(content, False)[1] == 0 and prune and ipage in parsed_pages:
+                page_cache.remove_old(ipage, content_hash)
+                removed_count = removed_count + 1
+
+    elapsed = time.time() - start_time
+    missing_count = len([entry for entry in entries if not library_index.exists(entry[2])])
+    logger.info('Parsed %s cached pages in %.2f s, %s wallpapers (%s only in older copies), %s not in the library, '
+                '%s older copies pruned.'
+                % (str(len(page_indexes)), elapsed, str(len(entries)), str(len(entries) - current_count),
+                   str(missing_count), str(removed_count)))
+
+    return entries
+
+
+def log_crawl_speed(page_count, image_count, elapsed):
+    """
+    输出爬取的页面和图片数量以及速度
+    1、 页面数量
+    2、 图片数量
+    3、 耗时，单位秒
+    """
+
+    logger.info('Crawled %s pages and %s images in %.2f s, %.2f pages/s, %.2f images/s.'
+                % (str(page_count), str(image_count), elapsed,
+                   page_count / elapsed if elapsed > 0 else 0.0,
+                   image_count / elapsed if elapsed > 0 else 0.0))
 
-    get_prohui_wpurl_by_index(sys.argv[1])
-    sys.exit(0)
 
-    if len(sys.argv) > 1:
-        dw_params = sys.argv[1]
+if __name__ == '__main__':
+    """
+    模块调试
+    """
+
+    parser = argparse.ArgumentParser(description='download bing wallpaper from prohui')
+    parser.add_argument('param', nargs='?', default='',
+                        help='number of recent days, or one date like 20190101')
+    parser.add_argument('--full', action='store_true',
+                        help='crawl every listing page instead of stopping at known pages')
+    parser.add_argument('--offline', action='store_true',
+                        help='only parse the cached listing pages, without network access or deleting anything')
+    parser.add_argument('--prune-cache', action='store_true',
+                        help='with --offline, delete older page copies that add no wallpaper to the newest pages')
+    parser.add_argument('--check-remote', action='store_true',
+                        help='compare existing images with the remote Content-Length and download changed ones')
+    parser.add_argument('--page-workers', type=int, default=1,
+                        help='number of listing pages requested at the same time')
+    parser.add_argument('--image-workers', type=int, default=1,
+                        help='number of images downloaded at the same time')
+    parser.add_argument('--blob-store', default=None,
+                        help='content-addressed store directory, library files become hardlinks to it')
+    args = parser.parse_args()
+
+    if args.param != '':
+        dw_params = args.param
         try:
             dw_params = int(dw_params)
         except Exception as e:
@@ -671,4 +774,6 @@ if __name__ == '__main__':
     else:
         dw_params = ""
 
-    download_prohui_wallpaper_main(str(dw_params))
+    set_blob_store(args.blob_store)
+    download_prohui_wallpaper_main(str(dw_params), not args.full, args.page_workers, args.image_workers, args.offline,
+                                   args.check_remote, args.prune_cache)
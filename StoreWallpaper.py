@@ -0,0 +1,94 @@
+#!/bin/python
+#-*- coding:utf-8 -*-
+
+import os
+import sys
+import time
+import argparse
+import platform
+import concurrent.futures
+
+from common_logger import Logger
+from common_blobstore import open_blob_store
+from common_library import list_library_images
+
+"""
+把已有的壁纸目录转换为按内容保存的存储
+1、遍历多个壁纸目录的jpg图片，计算SHA-256后加入存储目录
+2、内容相同的图片都替换为指向存储文件的硬链接，必应壁纸和品汇壁纸中相同的图片只占一份空间
+3、存储目录需要和壁纸目录在同一个文件系统，否则只能复制，不能节省空间
+"""
+
+logger = Logger('STORE_WP')
+
+
+def store_library(root_dirs, blob_dir, workers=4):
+    """
+    将壁纸目录中的图片全部加入存储，返回(图片数量, 不同内容数量, 节省的字节数)
+    1、壁纸存放的根目录列表
+    2、存储目录
+    3、并发计算哈希的线程数
+    """
+
+    start_time = time.time()
+    blob_store = open_blob_store(blob_dir)
+    if blob_store is None:
+        return 0, 0, 0
+
+    images = [os.path.join(root_dir, rel_path)
+              for root_dir in root_dirs for rel_path, size, mtime in list_library_images(root_dir)]
+
+    digests = set()
+    saved_bytes = 0
+    total_bytes = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = [(image_path, executor.submit(blob_store.put, image_path)) for image_path in images]
+        for image_path, future in futures:
+            try:
+                digest, saved = future.result()
+            except Exception as e:
+                logger.error("store the image error: %s (%s)" % (image_path, str(e)))
+                continue
+
+            digests.add(digest)
+            saved_bytes = saved_bytes + saved
+            total_bytes = total_bytes + os.path.getsize(image_path)
+
+    elapsed = time.time() - start_time
+    logger.info("File Count: %s, unique: %s, reclaimed: %.1f MB"
+                % (str(len(images)), str(len(digests)), saved_bytes / 1048576.0))
+    logger.info("Hashed %.1f MB in %.2f s, %.1f MB/s"
+                % (total_bytes / 1048576.0, elapsed, total_bytes / 1048576.0 / elapsed if elapsed > 0 else 0.0))
+
+    return len(images), len(digests), saved_bytes
+
+
+if __name__ == '__main__':
+    """
+    模块调试
+    """
+
+    sysstr = platform.system()
+    if(sysstr == "Windows"):
+        user_home = os.environ['HOMEPATH']
+    else:
+        user_home = os.environ['HOME']
+
+    pictures_dir = user_home + os.sep + "Pictures"
+
+    parser = argparse.ArgumentParser(description='store wallpaper libraries by content and hardlink duplicates')
+    parser.add_argument('root_dirs', nargs='*',
+                        default=[pictures_dir + os.sep + "必应壁纸", pictures_dir + os.sep + "品汇壁纸"],
+                        help='wallpaper directories to store')
+    parser.add_argument('--blob-store', default=pictures_dir + os.sep + ".wallpaper_blobs",
+                        help='content-addressed store directory')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of hashing threads')
+    args = parser.parse_args()
+
+    root_dirs = [root_dir for root_dir in args.root_dirs if os.path.isdir(root_dir)]
+    if len(root_dirs) == 0:
+        logger.error("the wallpaper directory not exists: %s" % ', '.join(args.root_dirs))
+        sys.exit(0)
+
+    store_library(root_dirs, args.blob_store, args.workers)
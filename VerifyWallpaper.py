@@ -0,0 +1,170 @@
+#!/bin/python
+#-*- coding:utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import concurrent.futures
+
+from common_logger import Logger
+from common_image import probe_image_size
+from common_library import list_library_images
+
+"""
+检查整个壁纸目录的图片是否完整
+1、多进程并发检查，除了尺寸以外还会完整解码图片，发现下载不完整的JPEG
+2、检查结果按(路径, 大小, 修改时间)缓存，再次检查时只检查有变化的文件
+3、dry-run只输出有问题的文件，不删除
+"""
+
+logger = Logger('VERIFY_WP')
+
+VERIFY_CACHE_NAME = '.wallpaper_verify.json'
+IMAGE_HEIGHT = 1080
+
+
+def verify_one_image(image_path):
+    """
+    完整检查一张图片，返回(是否正确, 原因)，在子进程中执行
+    1、图片带路径名称
+    """
+
+    try:
+        imgwd, imght, imgft = probe_image_size(image_path)
+        if int(imght) != IMAGE_HEIGHT:
+            return False, 'height %s' % str(imght)
+
+        from PIL import Image
+
+        with Image.open(image_path) as img:
+            img.verify()
+        with Image.open(image_path) as img:     # verify之后需要重新打开才能解码
+            img.load()
+
+        return True, ''
+
+    except Exception as e:
+        return False, str(e)
+
+
+def load_verify_cache(root_dir):
+    """
+    读取检查结果缓存
+    1、壁纸存放的根目录
+    """
+
+    cache_path = os.path.join(root_dir, VERIFY_CACHE_NAME)
+    if not os.path.exists(cache_path):
+        return {}
+
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error("load the verify cache error: %s" % str(e))
+        return {}
+
+
+def save_verify_cache(root_dir, cache):
+    """
+    保存检查结果缓存
+    1、壁纸存放的根目录
+    2、相对路径 -> [大小, 修改时间, 是否正确, 原因]
+    """
+
+    try:
+        with open(os.path.join(root_dir, VERIFY_CACHE_NAME), 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+    except Exception as e:
+        logger.error("save the verify cache error: %s" % str(e))
+
+
+def verify_library(root_dir, workers=None, dry_run=False):
+    """
+    检查整个壁纸目录，返回有问题的文件列表[(相对路径, 原因)]
+    1、壁纸存放的根目录
+    2、并发检查的进程数，默认为CPU数量
+    3、只输出有问题的文件，不删除
+    """
+
+    start_time = time.time()
+
+    cache = load_verify_cache(root_dir)
+    images = list_library_images(root_dir)
+
+    new_cache = {}
+    to_check = []
+    for rel_path, size, mtime in images:
+        cached = cache.get(rel_path)
+        if cached is not None and cached[0] == size and cached[1] == mtime:
+            new_cache[rel_path] = cached
+        else:
+            to_check.append((rel_path, size, mtime))
+
+    check_bytes = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        paths = [os.path.join(root_dir, rel_path) for rel_path, size, mtime in to_check]
+        results = executor.map(verify_one_image, paths, chunksize=16)
+        for (rel_path, size, mtime), (ok, reason) in zip(to_check, results):
+            new_cache[rel_path] = [size, mtime, ok, reason]
+            check_bytes = check_bytes + size
+
+    bad_images = []
+    for rel_path in sorted(new_cache):
+        size, mtime, ok, reason = new_cache[rel_path]
+        if ok:
+            continue
+
+        bad_images.append((rel_path, reason))
+        if dry_run:
+            logger.error("the damaged file: %s (%s)" % (rel_path, reason))
+        else:
+            try:
+                os.remove(os.path.join(root_dir, rel_path))
+                logger.info("the damaged file is delete: %s (%s)" % (rel_path, reason))
+            except Exception as e:
+                logger.error("delete the damaged file error: %s" % str(e))
+            del new_cache[rel_path]
+
+    save_verify_cache(root_dir, new_cache)
+
+    elapsed = time.time() - start_time
+    logger.info("File Count: %s, checked: %s, cached: %s, damaged: %s"
+                % (str(len(images)), str(len(to_check)), str(len(images) - len(to_check)), str(len(bad_images))))
+    logger.info("Checked %.1f MB in %.2f s, %.1f files/s, %.1f MB/s"
+                % (check_bytes / 1048576.0, elapsed,
+                   len(to_check) / elapsed if elapsed > 0 else 0.0,
+                   check_bytes / 1048576.0 / elapsed if elapsed > 0 else 0.0))
+
+    return bad_images
+
+
+if __name__ == '__main__':
+    """
+    模块调试
+    """
+
+    sysstr = platform.system()
+    if(sysstr == "Windows"):
+        user_home = os.environ['HOMEPATH']
+    else:
+        user_home = os.environ['HOME']
+
+    parser = argparse.ArgumentParser(description='verify the whole wallpaper library')
+    parser.add_argument('root_dir', nargs='?',
+                        default=user_home + os.sep + "Pictures" + os.sep + "必应壁纸",
+                        help='wallpaper directory to verify')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of checking processes, default is the cpu count')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only report the damaged files, do not delete them')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root_dir):
+        logger.error("the wallpaper directory not exists: %s" % args.root_dir)
+        sys.exit(0)
+
+    verify_library(args.root_dir, args.workers, args.dry_run)
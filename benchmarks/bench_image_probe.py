@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common_image import probe_image_size
+
+"""
+比较PIL和JPEG头部读取两种方式获取图片尺寸的速度
+1、在临时目录生成指定数量的1920x1080测试图片，带EXIF信息
+2、分别统计两种方式每秒检查的文件数量
+"""
+
+
+def make_library(root_dir, count):
+    """
+    生成测试用的壁纸目录
+    1、目录
+    2、图片数量
+    """
+
+    img = Image.new('RGB', (1920, 1080), (30, 90, 160))
+    exif = Image.Exif()
+    exif[0x010E] = 'synthetic wallpaper ' * 200     # ImageDescription，让SOF段离文件头更远
+    sample = os.path.join(root_dir, 'sample.jpg')
+    img.save(sample, 'JPEG', quality=90, exif=exif)
+
+    for i in range(count):
+        shutil.copyfile(sample, os.path.join(root_dir, '2019%04d_Synthetic%d_ZH-CN.jpg' % (i, i)))
+    os.remove(sample)
+
+
+def bench_pil(paths):
+    for path in paths:
+        with Image.open(path) as img:
+            img.height
+
+
+def bench_probe(paths):
+    for path in paths:
+        probe_image_size(path)
+
+
+def run(name, func, paths, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(paths)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print('%-6s %8.3f ms  %10.0f files/s' % (name, best * 1000, len(paths) / best))
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark PIL vs header-only image size probe')
+    parser.add_argument('--count', type=int, default=2000, help='number of synthetic images')
+    parser.add_argument('--repeat', type=int, default=5, help='best of N runs')
+    args = parser.parse_args()
+
+    root_dir = tempfile.mkdtemp(prefix='wp_bench_')
+    try:
+        make_library(root_dir, args.count)
+        paths = [os.path.join(root_dir, name) for name in sorted(os.listdir(root_dir))]
+
+        pil_time = run('PIL', bench_pil, paths, args.repeat)
+        probe_time = run('probe', bench_probe, paths, args.repeat)
+        print('speedup %.1fx' % (pil_time / probe_time))
+    finally:
+        shutil.rmtree(root_dir)
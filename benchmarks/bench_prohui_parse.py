@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import argparse
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common_pagecache import open_page_cache
+from common_prohui import parse_prohui_listing
+
+"""
+比较prohui列表页的两种解析方式的速度
+1、页面来自壁纸目录下缓存的列表页，没有指定目录时生成模拟页面
+2、legacy为原来的写法：每个条目两次字符串XPath查询，并且把整个文档tostring
+3、统计每页的解析时间
+"""
+
+ITEM_HTML = ('<li class="item"><a href="/wp/%d"><div class="info"><span class="y">%d</span>'
+             '<span class="z">%s 08:00</span></div>'
+             '<img src="http://cdn.prohui.com/wallpaper/OHR.Synthetic%d_ZH-CN%d_1920x1080.jpg'
+             '?imageView2/1/w/500/h/284" alt="wallpaper %d"/></a></li>')
+
+
+def make_pages(count):
+    """
+    生成模拟的列表页，每页14个条目
+    1、页面数量
+    """
+
+    pages = []
+    for ipage in range(count):
+        items = []
+        for i in range(14):
+            k = ipage * 14 + i
+            date = '20%02d-%02d-%02d' % (15 + k // 336, k // 28 % 12 + 1, k % 28 + 1)
+            items.append(ITEM_HTML % (k, k, date, k, k * 7919, k))
+        nav = '<div class="nav">' + '<a href="#">link</a>' * 200 + '</div>'
+        pages.append(('<html><head><title>prohui</title></head><body>%s<ul class="appList">%s</ul>%s</body></html>'
+                      % (nav, ''.join(items), nav)).encode('utf-8'))
+
+    return pages
+
+
+def load_pages(wp_root_dir):
+    """
+    读取壁纸目录下缓存的prohui列表页
+    1、壁纸存放的根目录
+    """
+
+    page_cache = open_page_cache(wp_root_dir, 'prohui')
+    return [page_cache.get(ipage) for ipage in page_cache.page_indexes()]
+
+
+def parse_legacy(content):
+    html = etree.HTML(content)
+    etree.tostring(html, encoding='utf-8')
+    entries = []
+    for link in html.xpath('//ul[@class="appList"]/li[@class="item"]'):
+        result1 = link.xpath('./a/div/span[@class="z"]')
+        result2 = link.xpath('./a/img')
+        image_date = result1[0].text.strip()[0:10].replace('-', '')
+        image_url = result2[0].attrib['src'].strip().replace('/w/500', '/w/1920').replace('/h/284', '/h/1080')
+        entries.append((image_date, image_url))
+
+    return entries
+
+
+def bench_legacy(pages):
+    for content in pages:
+        parse_legacy(content)
+
+
+def bench_parser(pages):
+    for content in pages:
+        parse_prohui_listing(content)
+
+
+def run(name, func, pages, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(pages)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print('%-7s %8.3f ms  %8.3f ms/page' % (name, best * 1000, best * 1000 / len(pages)))
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark prohui listing page parsing')
+    parser.add_argument('wp_root_dir', nargs='?', default=None,
+                        help='wallpaper directory with cached listing pages, synthetic pages if omitted')
+    parser.add_argument('--count', type=int, default=131, help='number of synthetic pages')
+    parser.add_argument('--repeat', type=int, default=5, help='best of N runs')
+    args = parser.parse_args()
+
+    if args.wp_root_dir is not None:
+        pages = [content for content in load_pages(args.wp_root_dir) if content is not None]
+    else:
+        pages = make_pages(args.count)
+
+    if len(pages) == 0:
+        print('no cached listing pages found')
+        sys.exit(0)
+
+    legacy_time = run('legacy', bench_legacy, pages, args.repeat)
+    parser_time = run('parser', bench_parser, pages, args.repeat)
+    print('speedup %.1fx' % (legacy_time / parser_time))
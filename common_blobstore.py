@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import shutil
+import hashlib
+import threading
+
+from common_logger import Logger
+
+"""
+按内容SHA-256保存图片的可选存储
+1、每张图片在存储目录中只保存一份，壁纸目录中按日期命名的文件都是指向它的硬链接，多个壁纸目录共用
+2、不能建立硬链接时(例如跨文件系统)尝试reflink，仍然不行时新内容完整复制到存储，已有内容不再替换壁纸目录中的文件，
+   每个存储只提示一次，完整复制会占用双倍的磁盘空间
+3、计算哈希时使用mmap，mmap失败时使用大块缓冲读取
+4、默认不启用，通过set_blob_store指定存储目录后生效，存储目录需要和壁纸目录在同一个文件系统
+"""
+
+logger = Logger('BLOB')
+
+HASH_BUFFER_SIZE = 1024 * 1024      # 不能使用mmap时每次读取的字节数
+FICLONE = 0x40049409                # Linux的reflink ioctl
+
+blob_stores = {}
+blob_stores_lock = threading.Lock()
+active_blob_dir = None
+
+
+def hash_file(file_path):
+    """
+    计算文件内容的SHA-256
+    1、文件带路径名称
+    """
+
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                sha256.update(data)
+            return sha256.hexdigest()
+        except (ValueError, OSError):   # 空文件或者不支持mmap的文件系统
+            pass
+
+        f.seek(0)
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            size = f.readinto(buffer)
+            if size == 0:
+                break
+            sha256.update(view[:size])
+
+    return sha256.hexdigest()
+
+
+def reflink_file(src_path, dst_path):
+    """
+    使用reflink复制文件，只复制元数据，数据块在修改前共用，不支持时抛出OSError
+    1、源文件
+    2、目标文件
+    """
+
+    if not sys.platform.startswith('linux'):
+        raise OSError('reflink is not supported on %s' % sys.platform)
+
+    import fcntl
+
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dst_path)
+            raise
+
+
+def link_file(src_path, dst_path):
+    """
+    将源文件放到目标位置：优先硬链接，其次reflink，返回使用的方式，都不支持时抛出OSError
+    目标文件已经存在时原子替换
+    1、源文件
+    2、目标文件
+    """
+
+    temp_name = dst_path + '.link'
+    if os.path.exists(temp_name):
+        os.remove(temp_name)
+
+    try:
+        os.link(src_path, temp_name)
+        method = 'link'
+    except OSError:
+        reflink_file(src_path, temp_name)
+        method = 'reflink'
+
+    os.replace(temp_name, dst_path)
+    return method
+
+
+def copy_file(src_path, dst_path):
+    """
+    完整复制文件，先写入临时文件，目标文件已经存在时原子替换
+    1、源文件
+    2、目标文件
+    """
+
+    temp_name = dst_path + '.link'
+    try:
+        shutil.copyfile(src_path, temp_name)
+        os.replace(temp_name, dst_path)
+    except OSError:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
+def link_or_copy(src_path, dst_path):
+    """
+    将源文件放到目标位置：优先硬链接，其次reflink，最后完整复制，返回使用的方式
+    目标文件已经存在时原子替换
+    1、源文件
+    2、目标文件
+    """
+
+    try:
+        return link_file(src_path, dst_path)
+    except OSError:
+        copy_file(src_path, dst_path)
+        return 'copy'
+
+
+class BlobStore(object):
+    """
+    按内容哈希保存图片的存储目录，文件路径为 哈希前两位/哈希.jpg
+    1、存储目录
+    """
+
+    def __init__(self, blob_dir):
+        self.blob_dir = blob_dir
+        self.lock = threading.Lock()
+        self.copy_warned = False
+        if not os.path.isdir(blob_dir):
+            os.makedirs(blob_dir)
+
+    def get_blob_path(self, digest):
+        """
+        获取哈希对应的存储文件
+        1、内容哈希
+        """
+
+        return os.path.join(self.blob_dir, digest[0:2], digest + '.jpg')
+
+    def warn_copy(self, image_path):
+        """
+        不能建立硬链接和reflink时提示一次，例如存储目录和壁纸目录不在同一个文件系统
+        1、图片带路径名称
+        """
+
+        if not self.copy_warned:
+            self.copy_warned = True
+            logger.warn("can not link %s into the blob store %s, images are copied and use twice the disk space"
+                        % (image_path, self.blob_dir))
+
+    def put(self, image_path):
+        """
+        将壁纸目录中的图片加入存储，内容已经存在时把图片替换为指向存储文件的硬链接，
+        不能建立链接时保留原来的图片，返回(内容哈希, 节省的字节数)
+        1、图片带路径名称
+        """
+
+        digest = hash_file(image_path)
+        blob_path = self.get_blob_path(digest)
+
+        with self.lock:
+            if not os.path.exists(blob_path):
+                blob_subdir = os.path.dirname(blob_path)
+                if not os.path.isdir(blob_subdir):
+                    os.mkdir(blob_subdir)
+                if link_or_copy(image_path, blob_path) == 'copy':
+                    self.warn_copy(image_path)
+                return digest, 0
+
+            image_stat = os.stat(image_path)
+            blob_stat = os.stat(blob_path)
+            if image_stat.st_ino == blob_stat.st_ino and image_stat.st_dev == blob_stat.st_dev:
+                return digest, 0
+
+            try:
+                link_file(blob_path, image_path)
+            except OSError:     # 再复制一份内容相同的文件不会节省空间
+                self.warn_copy(image_path)
+                return digest, 0
+
+        return digest, image_stat.st_size
+
+
+def set_blob_store(blob_dir):
+    """
+    启用或关闭存储，之后保存的图片都会加入存储
+    1、存储目录，为None时关闭
+    """
+
+    global active_blob_dir
+
+    active_blob_dir = blob_dir
+
+
+def open_blob_store(blob_dir=None):
+    """
+    获取存储目录对应的存储，同一个目录只创建一次，没有启用或打开失败时返回None
+    1、存储目录，为None时使用set_blob_store指定的目录
+    """
+
+    if blob_dir is None:
+        blob_dir = active_blob_dir
+    if blob_dir is None:
+        return None
+
+    with blob_stores_lock:
+        if blob_dir not in blob_stores:
+            try:
+                blob_stores[blob_dir] = BlobStore(blob_dir)
+            except Exception as e:
+                logger.error("open the blob store error: %s" % str(e))
+                blob_stores[blob_dir] = None
+
+        return blob_stores[blob_dir]
+
+
+def store_image(image_path):
+    """
+    存储启用时将新保存的图片加入存储，返回内容哈希，没有启用或失败时返回''
+    1、图片带路径名称
+    """
+
+    blob_store = open_blob_store()
+    if blob_store is None:
+        return ''
+
+    try:
+        return blob_store.put(image_path)[0]
+    except Exception as e:
+        logger.error("add the image to blob store error: %s" % str(e))
+        return ''
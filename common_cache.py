@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import datetime
+import threading
+
+from common_logger import Logger
+
+"""
+壁纸元数据的本地持久化缓存
+1、以(来源, 区域, 日期)为键，保存解析得到的图片名称、下载地址和结束日期
+2、历史日期的壁纸不会再变化，永不过期；当天的壁纸只缓存较短时间
+3、数据库保存在壁纸目录下，每个目录共用一个连接
+4、以(区域, 日期)为键，保存必应图片的哈希(hsh)和urlbase，用于识别不同日期、不同区域的同一张图片
+"""
+
+logger = Logger('CACHE')
+
+METADATA_DB_NAME = '.wallpaper_meta.db'
+TODAY_TTL = 3600        # 当天元数据的有效时间，单位秒
+
+metadata_caches = {}
+metadata_caches_lock = threading.Lock()
+
+
+class MetadataCache(object):
+    """
+    基于SQLite的元数据缓存，可以在多个线程中共用
+    1、数据库文件路径
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')    # 避免每次提交都在壁纸目录创建删除日志文件
+        self.conn.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                          'source TEXT NOT NULL, market TEXT NOT NULL, date TEXT NOT NULL, '
+                          'name TEXT NOT NULL, url TEXT NOT NULL, enddate TEXT NOT NULL, '
+                          'updated REAL NOT NULL, PRIMARY KEY (source, market, date))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS image_hash ('
+                          'market TEXT NOT NULL, date TEXT NOT NULL, hsh TEXT NOT NULL, '
+                          'urlbase TEXT NOT NULL, name TEXT NOT NULL, updated REAL NOT NULL, '
+                          'PRIMARY KEY (market, date))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS image_hash_hsh ON image_hash (hsh)')
+        self.conn.commit()
+
+    def get(self, source, market, image_date):
+        """
+        获取缓存的元数据，返回(图片名称, 下载地址, 结束日期)，没有或已过期返回None
+        1、来源，例如bing、ioliu
+        2、区域市场
+        3、图片日期
+        """
+
+        with self.lock:
+            row = self.conn.execute('SELECT name, url, enddate, updated FROM metadata '
+                                    'WHERE source = ? AND market = ? AND date = ?',
+                                    (source, market, str(image_date))).fetchone()
+        if row is None:
+            return None
+
+        name, url, enddate, updated = row
+        today = datetime.datetime.now().strftime('%Y%m%d')
+        if str(image_date) >= today and time.time() - updated > TODAY_TTL:
+            return None
+
+        return name, url, enddate
+
+    def put(self, source, market, image_date, name, url, enddate):
+        """
+        保存某一天的元数据
+        1、来源，例如bing、ioliu
+        2、区域市场
+        3、图片日期
+        4、图片名称，不带路径
+        5、下载地址
+        6、结束日期
+        """
+
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (source, market, str(image_date), name, url, enddate, time.time()))
+            self.conn.commit()
+
+    def put_many(self, source, market, rows, replace=True):
+        """
+        一次提交保存多天的元数据
+        1、来源，例如bing、ioliu
+        2、区域市场
+        3、[(图片日期, 图片名称, 下载地址, 结束日期)]
+        4、是否覆盖已有的日期，为False时只保存还没有的日期
+        """
+
+        updated = time.time()
+        with self.lock:
+            self.conn.executemany('INSERT OR %s INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)'
+                                  % ('REPLACE' if replace else 'IGNORE'),
+                                  [(source, market, str(image_date), name, url, enddate, updated)
+                                   for image_date, name, url, enddate in rows])
+            self.conn.commit()
+
+    def put_hash(self, market, image_date, hsh, urlbase, name):
+        """
+        保存某一天必应图片的哈希
+        1、区域市场
+        2、图片日期
+        3、必应图片哈希hsh
+        4、必应图片的urlbase
+        5、图片名称，不带路径
+        """
+
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO image_hash VALUES (?, ?, ?, ?, ?, ?)',
+                              (market, str(image_date), hsh, urlbase, name, time.time()))
+            self.conn.commit()
+
+    def get_hash(self, market, image_date):
+        """
+        获取某一天必应图片的哈希，返回(哈希, urlbase, 图片名称)，没有返回None
+        1、区域市场
+        2、图片日期
+        """
+
+        with self.lock:
+            return self.conn.execute('SELECT hsh, urlbase, name FROM image_hash WHERE market = ? AND date = ?',
+                                     (market, str(image_date))).fetchone()
+
+    def find_hash(self, hsh):
+        """
+        查找哈希相同的所有图片，返回[(区域, 日期, 图片名称)]
+        1、必应图片哈希hsh
+        """
+
+        with self.lock:
+            return self.conn.execute('SELECT market, date, name FROM image_hash WHERE hsh = ? ORDER BY date',
+                                     (hsh,)).fetchall()
+
+
+def open_metadata_cache(wp_root_dir):
+    """
+    获取壁纸目录对应的元数据缓存，同一个目录只打开一次，打开失败返回None
+    1、壁纸存放的根目录
+    """
+
+    with metadata_caches_lock:
+        if wp_root_dir not in metadata_caches:
+            try:
+                metadata_caches[wp_root_dir] = MetadataCache(os.path.join(wp_root_dir, METADATA_DB_NAME))
+            except Exception as e:
+                logger.error("open the metadata cache error: %s" % str(e))
+                metadata_caches[wp_root_dir] = None
+
+        return metadata_caches[wp_root_dir]
@@ -0,0 +1,594 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import random
+import socket
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common_logger import Logger
+from common_blobstore import store_image
+from common_library import library_add, library_remove
+
+"""
+所有壁纸站点共用的HTTP连接层
+1、同一个进程共用一个连接池会话，保持长连接，避免重复的TCP和TLS握手
+2、每个站点限制连接池大小和并发请求数量，流式下载在内容读完之前一直占用并发数量，连接池满时等待而不是丢弃长连接
+3、统一的默认超时时间和User-Agent
+4、多个来源之间的对冲下载
+5、指数退避加随机抖动的重试，每个站点一个熔断器，站点连续失败后在冷却时间内直接跳过
+"""
+
+logger = Logger('HTTP')
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36"
+              " (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36")
+
+DEFAULT_TIMEOUT = (10, 60)      # (连接超时, 读取超时)，单位秒
+HOST_CONCURRENCY = 4            # 每个站点同时进行的最大请求数，同时也是每个站点的连接池大小
+POOL_HOSTS = 8                  # 连接池最多保存的站点数量
+DOWNLOAD_CHUNK_SIZE = 64 * 1024     # 下载图片时每次读取的字节数
+
+RETRY_TIMES = 3             # 每次请求最多尝试的次数
+RETRY_BASE_DELAY = 0.5      # 第一次重试前的最长等待时间，之后每次翻倍，单位秒
+RETRY_MAX_DELAY = 8         # 重试前的最长等待时间，单位秒
+BREAKER_THRESHOLD = 3       # 站点连续失败多少次后熔断
+BREAKER_COOLDOWN = 300      # 熔断后跳过站点的时间，单位秒
+
+session = None
+session_lock = threading.Lock()
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+
+def get_session():
+    """
+    获取进程内共用的连接池会话，第一次调用时创建
+    """
+
+    global session
+
+    with session_lock:
+        if session is None:
+            new_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=HOST_CONCURRENCY, pool_block=True)
+            new_session.mount('http://', adapter)
+            new_session.mount('https://', adapter)
+            new_session.headers.update({'User-Agent': USER_AGENT})
+            session = new_session
+
+    return session
+
+
+def get_host_semaphore(url):
+    """
+    获取某个站点的并发限制信号量
+    1、请求的链接地址
+    """
+
+    host = urllib.parse.urlsplit(url).netloc
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return host_semaphores[host]
+
+
+class CircuitBreaker(object):
+    """
+    站点熔断器：连续失败达到阈值后熔断，冷却时间内直接跳过该站点，冷却结束后重新尝试
+    1、站点名称
+    2、连续失败的阈值
+    3、冷却时间，单位秒
+    """
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trip_count = 0
+        self.skip_count = 0
+        self.lock = threading.Lock()
+
+    def state(self):
+        """
+        熔断器状态：closed正常，open熔断中，half-open冷却结束等待重新尝试
+        """
+
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """
+        是否允许访问该站点，熔断中时记录跳过的次数
+        """
+
+        with self.lock:
+            if self.state() == 'open':
+                self.skip_count = self.skip_count + 1
+                return False
+            return True
+
+    def record_success(self):
+        """
+        访问成功，清除连续失败次数并恢复正常
+        """
+
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """
+        访问失败，达到阈值或冷却后再次失败时熔断
+        """
+
+        with self.lock:
+            self.failures = self.failures + 1
+            if self.state() == 'half-open' or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.time()
+                self.trip_count = self.trip_count + 1
+                logger.warn("the website is unavailable, skip it for %s s: %s" % (str(self.cooldown), self.name))
+
+
+def get_breaker(url):
+    """
+    获取某个站点的熔断器
+    1、请求的链接地址
+    """
+
+    host = urllib.parse.urlsplit(url).netloc
+    with breakers_lock:
+        if host not in breakers:
+            breakers[host] = CircuitBreaker(host)
+        return breakers[host]
+
+
+def log_breaker_summary():
+    """
+    输出每个站点熔断器的状态和熔断次数
+    """
+
+    with breakers_lock:
+        for host in sorted(breakers):
+            breaker = breakers[host]
+            logger.info("website %s: state %s, trips %s, skipped %s"
+                        % (host, breaker.state(), str(breaker.trip_count), str(breaker.skip_count)))
+
+
+def get_retry_delay(attempt):
+    """
+    指数退避加随机抖动的等待时间
+    1、第几次重试，从0开始
+    """
+
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def http_get_retry(url, retry_times=RETRY_TIMES, **kwargs):
+    """
+    带重试和熔断的GET请求，成功返回状态码为200的response，失败或站点熔断中返回None
+    1、请求的链接地址
+    2、最多尝试的次数
+    3、传给requests的其他参数
+    """
+
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        return None
+
+    for attempt in range(retry_times):
+        try:
+            response = http_get(url, **kwargs)
+            if response.status_code == 200:
+                breaker.record_success()
+                return response
+            logger.error("request the website error %s: %s" % (str(response.status_code), url))
+            if response.status_code == 404:     # 资源不存在，重试也没有用
+                return None
+        except requests.RequestException as e:
+            logger.error("can not connect the website: %s" % str(e))
+
+        if attempt < retry_times - 1:
+            time.sleep(get_retry_delay(attempt))
+
+    breaker.record_failure()
+    return None
+
+
+def release_on_close(response, semaphore):
+    """
+    流式下载时在response关闭后才释放站点的并发限制，保证下载图片内容的过程也在限制之内
+    1、流式请求返回的response
+    2、站点的并发限制信号量
+    """
+
+    close = response.close
+    released = []
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if len(released) == 0:
+                released.append(True)
+                semaphore.release()
+
+    response.close = close_and_release
+    return response
+
+
+def http_get(url, **kwargs):
+    """
+    按站点并发限制通过共用会话发起GET请求，stream为True时需要在with中使用返回值，
+    内容读完并关闭后才释放并发限制
+    1、请求的链接地址
+    2、传给requests的其他参数
+    """
+
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    semaphore = get_host_semaphore(url)
+    semaphore.acquire()
+    try:
+        response = get_session().get(url, **kwargs)
+    except BaseException:
+        semaphore.release()
+        raise
+
+    if kwargs.get('stream', False):
+        return release_on_close(response, semaphore)
+
+    semaphore.release()     # 非流式请求返回时内容已经全部读取
+    return response
+
+
+def http_head(url, **kwargs):
+    """
+    按站点并发限制通过共用会话发起HEAD请求
+    1、请求的链接地址
+    2、传给requests的其他参数
+    """
+
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    with get_host_semaphore(url):
+        return get_session().head(url, **kwargs)
+
+
+def get_remote_size(url):
+    """
+    通过HEAD请求获取远程文件的大小，获取失败、站点熔断中或者内容经过压缩时返回None
+    1、文件的链接地址
+    """
+
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        return None
+
+    try:
+        response = http_head(url, allow_redirects=True)
+    except requests.RequestException as e:
+        logger.error("can not connect the website: %s" % str(e))
+        breaker.record_failure()
+        return None
+
+    if response.status_code != 200:
+        return None
+
+    breaker.record_success()
+    content_length = response.headers.get('Content-Length')
+    if content_length is None or response.headers.get('Content-Encoding') is not None:
+        return None
+
+    return int(content_length)
+
+
+def get_url_content(url):
+    '''
+    获取网页或图片的全部内容，状态码不是200时抛出异常
+    1、获取内容的链接地址
+    '''
+
+    response = http_get(url)
+    response.raise_for_status()
+    return response.content
+
+
+def save_stream_to_file(chunks, image_path_name, validator=None):
+    """
+    将分块数据写入临时文件，全部写完并校验通过后再改名为正式文件，避免留下不完整的图片
+    1、数据块的迭代器
+    2、图片带路径名称
+    3、边下载边校验的对象，参考common_image.ImageStreamValidator，为None时不校验
+    """
+
+    temp_name = image_path_name + '.part'
+    try:
+        with open(temp_name, "wb") as code:
+            for chunk in chunks:
+                if validator is not None:
+                    validator.feed(chunk)
+                code.write(chunk)
+
+        if validator is not None:
+            ok, reason = validator.check(temp_name)
+            if not ok:
+                logger.error("the download image is damaged: %s (%s)" % (image_path_name, reason))
+                os.remove(temp_name)
+                library_remove(temp_name)
+                return False
+
+        os.replace(temp_name, image_path_name)
+        store_image(image_path_name)
+        library_add(image_path_name)
+        return True
+
+    except Exception as e:
+        logger.error("save the wallpaper error: %s" % str(e))
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        library_remove(temp_name)
+        return False
+
+
+def download_to_file(url, image_path_name, validator=None):
+    """
+    分块下载图片并保存，成功返回True
+    1、图片的链接地址
+    2、图片带路径名称
+    3、边下载边校验的对象，为None时不校验
+    """
+
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        return False
+
+    try:
+        response = http_get(url, stream=True)
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+
+    with response:
+        if response.status_code != 200:
+            logger.error("download the wallpaper error: %s" % url)
+            if response.status_code != 404:
+                breaker.record_failure()
+            return False
+
+        breaker.record_success()
+
+        content_length = response.headers.get('Content-Length')
+        if validator is not None and content_length is not None \
+                and response.headers.get('Content-Encoding') is None:
+            validator.content_length = int(content_length)
+
+        return save_stream_to_file(response.iter_content(DOWNLOAD_CHUNK_SIZE), image_path_name, validator)
+
+
+HEDGE_CLEANUP_TIMEOUT = 2       # 结束时等待被取消的下载关闭的最长时间，单位秒
+
+
+class HedgedAttempt(object):
+    """
+    对冲下载中某一个来源的下载任务
+    1、来源名称
+    2、下载地址
+    3、临时文件名称
+    """
+
+    def __init__(self, source, url, temp_name):
+        self.source = source
+        self.url = url
+        self.temp_name = temp_name
+        self.start_time = time.time()
+        self.end_time = None
+        self.response = None
+        self.first_byte = False
+        self.done = False
+        self.cancelled = False
+
+
+def hedged_download(candidates, image_path_name, hedge_delay, validator_factory=None, on_finish=None):
+    """
+    对冲下载：先从首选来源下载，超过指定时间还没有收到数据时并行启动下一个来源，
+    第一个校验通过的图片保存为正式文件，其他下载关闭连接并删除临时文件后才返回，
+    返回成功的来源名称，全部失败返回''
+    1、按优先级排列的(来源名称, 下载地址)的迭代器，启动某个来源前才取下一个，地址为''时跳过
+    2、图片带路径名称
+    3、启动下一个来源前等待首个数据块的时间，单位秒
+    4、创建校验对象的函数，参考common_image.ImageStreamValidator，为None时不校验
+    5、每个启动过的来源结束后调用on_finish(来源名称, 是否成功, 耗时)，被取消的来源没有结果，不调用
+    """
+
+    pending = iter(candidates)
+    cond = threading.Condition()
+    cancel = threading.Event()
+    attempts = []
+    winner = []
+
+    def run(attempt):
+        ok = False
+        breaker = get_breaker(attempt.url)
+        try:
+            validator = validator_factory() if validator_factory is not None else None
+            with http_get(attempt.url, stream=True) as response:
+                code = None
+                if response.status_code != 200:
+                    logger.error("download the wallpaper error: %s" % attempt.url)
+                    if response.status_code != 404:
+                        breaker.record_failure()
+                else:
+                    breaker.record_success()
+                    content_length = response.headers.get('Content-Length')
+                    if validator is not None and content_length is not None \
+                            and response.headers.get('Content-Encoding') is None:
+                        validator.content_length = int(content_length)
+
+                    with cond:      # 已经取消时不再创建临时文件
+                        if not cancel.is_set():
+                            attempt.response = response
+                            code = open(attempt.temp_name, "wb")
+
+                if code is not None:
+                    with code:
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            if cancel.is_set():
+                                break
+                            if not attempt.first_byte:
+                                with cond:
+                                    attempt.first_byte = True
+                                    cond.notify_all()
+                            if validator is not None:
+                                validator.feed(chunk)
+                            code.write(chunk)
+
+                    if not cancel.is_set():
+                        ok, reason = validator.check(attempt.temp_name) if validator is not None else (True, '')
+                        if not ok:
+                            logger.error("the download image is damaged: %s (%s)" % (attempt.url, reason))
+
+        except requests.RequestException as e:
+            if not cancel.is_set():
+                logger.error("can not connect website when download: %s" % str(e))
+                breaker.record_failure()
+        except Exception as e:
+            if not cancel.is_set():
+                logger.error("can not connect website when download: %s" % str(e))
+
+        with cond:
+            won = False
+            if ok and len(winner) == 0:
+                try:
+                    os.replace(attempt.temp_name, image_path_name)
+                    won = True
+                    winner.append(attempt.source)
+                    cancel.set()
+                except OSError as e:
+                    logger.error("save the wallpaper error: %s" % str(e))
+            if not won:
+                try:
+                    if os.path.exists(attempt.temp_name):
+                        os.remove(attempt.temp_name)
+                except OSError as e:
+                    logger.error("remove the temp file error: %s" % str(e))
+            attempt.cancelled = not won and cancel.is_set()     # 其他来源已经成功或者已经清理
+            attempt.end_time = time.time()
+            attempt.done = True
+            cond.notify_all()
+
+    def launch():
+        for source, url in pending:     # 下一个来源的地址在启动时才获取
+            if url == '' or not get_breaker(url).allow():
+                continue
+
+            logger.info("++==begin download image from %s: %s" % (source, url))
+            attempt = HedgedAttempt(source, url, image_path_name + '.' + source + '.part')
+            with cond:
+                attempts.append(attempt)
+            thread = threading.Thread(target=run, args=(attempt,))
+            thread.daemon = True
+            thread.start()
+            return True
+
+        return False
+
+    exhausted = False
+    while True:
+        with cond:
+            if len(winner) > 0:
+                break
+
+            running = [attempt for attempt in attempts if not attempt.done]
+            if exhausted:
+                if len(running) == 0:
+                    break
+                cond.wait()
+                continue
+
+            if any(attempt.first_byte for attempt in running):     # 已经在接收数据，等待下载结束
+                cond.wait()
+                continue
+
+            if len(running) > 0:    # 从最后启动的、还在下载的来源开始计算等待时间
+                wait_time = running[-1].start_time + hedge_delay - time.time()
+                if wait_time > 0:
+                    cond.wait(wait_time)
+                    continue
+
+        if not launch():    # 没有正在下载的来源，或者正在下载的来源太慢，启动下一个来源
+            exhausted = True
+
+    cleanup_hedged_attempts(attempts, cond, cancel)
+
+    if on_finish is not None:
+        for attempt in attempts:
+            if attempt.done and not attempt.cancelled:
+                on_finish(attempt.source, attempt.source in winner, attempt.end_time - attempt.start_time)
+
+    if len(winner) == 0:
+        if len(attempts) > 0:
+            library_remove(attempts[-1].temp_name)      # 只记录删除临时文件后的目录时间
+        return ''
+
+    store_image(image_path_name)
+    library_add(image_path_name)
+    return winner[0]
+
+
+def abort_response(response):
+    """
+    中断其他线程正在读取的流式response，关闭socket的读写使读取立即结束，
+    response由读取的线程自己关闭并释放站点的并发限制。直接close会等待读取线程持有的锁
+    1、流式请求返回的response
+    """
+
+    connection = getattr(response.raw, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        return
+
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def cleanup_hedged_attempts(attempts, cond, cancel):
+    """
+    取消对冲下载中还没有结束的来源：关闭连接，等待下载线程退出，最后删除残留的临时文件
+    1、[HedgedAttempt]
+    2、保护下载状态的条件变量
+    3、取消下载的事件
+    """
+
+    with cond:      # 取消之后还没有收到响应的下载不会再创建临时文件，只需要处理正在接收数据的下载
+        cancel.set()
+        losers = [attempt for attempt in attempts if not attempt.done and attempt.response is not None]
+
+    for attempt in losers:
+        abort_response(attempt.response)
+
+    deadline = time.time() + HEDGE_CLEANUP_TIMEOUT
+    with cond:
+        while any(not attempt.done for attempt in losers) and time.time() < deadline:
+            cond.wait(deadline - time.time())
+
+    for attempt in losers:
+        try:
+            if os.path.exists(attempt.temp_name):
+                os.remove(attempt.temp_name)
+        except OSError as e:
+            logger.error("remove the temp file error: %s" % str(e))
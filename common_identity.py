@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import collections
+import urllib.parse
+
+"""
+壁纸的统一标识
+1、从任意来源的下载地址或本地文件名中解析出 名称、区域、编号、分辨率、日期，例如：
+   http://cn.bing.com/th?id=OHR.SpringBadlands_ZH-CN8280871661_1920x1080.jpg&rf=...
+   http://cdn.prohui.com/wallpaper/OHR.SpringBadlands_ZH-CN8280871661_1920x1080.jpg?imageView2/...
+   20190501_SpringBadlands_ZH-CN8280871661.jpg
+2、名称、区域和编号相同即为同一张壁纸，不受路径分隔符、OHR.前缀、分辨率后缀和地址格式影响
+   名称不符合格式时仍然可以按文件名得到本地使用的名称，不会因为无法解析而丢掉某一天的图片
+3、按标识建立内存索引，比较和查找都是O(1)
+"""
+
+WALLPAPER_ID_PATTERN = re.compile(r'(?:^|[/\\=])(?:(\d{8})_)?(?:OHR\.)?([A-Za-z0-9_]+?)_([A-Za-z]{2}-[A-Za-z]{2}|ROW)(\d+)'
+                                  r'(?:_(\d+x\d+|UHD))?\.jpg', re.IGNORECASE)
+# 无法解析标识时从文件名中去掉的日期前缀、OHR.前缀、分辨率后缀和扩展名
+STEM_PREFIX_PATTERN = re.compile(r'^(?:\d{8}_)?(?:OHR\.)?')
+STEM_SUFFIX_PATTERN = re.compile(r'(?:_(?:\d+x\d+|UHD))?(?:\.jpg)?$', re.IGNORECASE)
+
+
+class WallpaperId(collections.namedtuple('WallpaperId', ['name', 'market', 'number', 'resolution', 'date'])):
+    """
+    壁纸标识：名称、区域、编号、分辨率(可能为None)、日期(可能为None)
+    """
+
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """
+        用于比较和索引的键，只包含名称、区域和编号
+        """
+
+        return self.name, self.market.upper(), self.number
+
+    @property
+    def stem(self):
+        """
+        不带日期和分辨率的名称，例如SpringBadlands_ZH-CN8280871661
+        """
+
+        return '%s_%s%s' % (self.name, self.market, self.number)
+
+    def file_name(self, image_date=None):
+        """
+        本地保存使用的规范文件名，例如20190501_SpringBadlands_ZH-CN8280871661.jpg
+        1、图片日期，为None时使用解析得到的日期
+        """
+
+        return '%s_%s.jpg' % (image_date if image_date is not None else self.date, self.stem)
+
+
+def parse_wallpaper_id(text):
+    """
+    从下载地址或文件名中解析壁纸标识，无法解析时返回None
+    1、下载地址、带路径或不带路径的文件名
+    """
+
+    if text is None or text == '':
+        return None
+
+    match = WALLPAPER_ID_PATTERN.search(text)
+    if match is None:
+        return None
+
+    image_date, name, market, number, resolution = match.groups()
+    return WallpaperId(name, market, number, resolution, image_date)
+
+
+def get_wallpaper_stem(text):
+    """
+    获取不带日期和分辨率的名称，例如SpringBadlands_ZH-CN8280871661，
+    无法解析标识时使用文件名去掉日期、OHR.前缀、分辨率后缀和扩展名，没有文件名时返回''
+    1、下载地址、带路径或不带路径的文件名
+    """
+
+    wid = parse_wallpaper_id(text)
+    if wid is not None:
+        return wid.stem
+
+    if text is None or text == '':
+        return ''
+
+    url = urllib.parse.urlsplit(text)
+    image_ids = urllib.parse.parse_qs(url.query).get('id')     # 必应的地址为th?id=OHR.xxx.jpg&rf=...
+    file_name = image_ids[0] if image_ids else re.split(r'[/\\]', url.path)[-1]
+
+    file_name = STEM_PREFIX_PATTERN.sub('', file_name, count=1)
+    return STEM_SUFFIX_PATTERN.sub('', file_name, count=1)
+
+
+def is_same_wallpaper(text_a, text_b):
+    """
+    判断两个下载地址或文件名是否是同一张壁纸，无法解析时比较文件名
+    1、下载地址或文件名
+    2、下载地址或文件名
+    """
+
+    wid_a = parse_wallpaper_id(text_a)
+    wid_b = parse_wallpaper_id(text_b)
+    if wid_a is not None and wid_b is not None:
+        return wid_a.key == wid_b.key
+
+    return os.path.basename(text_a) == os.path.basename(text_b)
+
+
+class WallpaperIdIndex(object):
+    """
+    按壁纸标识建立的内存索引，同一张壁纸保留第一次加入的值
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, text, value):
+        """
+        加入一张壁纸，无法解析标识时返回False
+        1、下载地址或文件名
+        2、保存的值，例如文件路径
+        """
+
+        wid = parse_wallpaper_id(text)
+        if wid is None:
+            return False
+
+        self.items.setdefault(wid.key, value)
+        return True
+
+    def get(self, text):
+        """
+        查找同一张壁纸保存的值，没有则返回None
+        1、下载地址、文件名或WallpaperId
+        """
+
+        wid = text if isinstance(text, WallpaperId) else parse_wallpaper_id(text)
+        if wid is None:
+            return None
+
+        return self.items.get(wid.key)
+
+
+def build_id_index(image_dir, resolution=None):
+    """
+    遍历一次目录，按壁纸标识建立 标识 -> 文件路径 的索引，目录不存在时返回空索引
+    1、图片目录
+    2、只包含指定分辨率的文件，为None时不限制
+    """
+
+    id_index = WallpaperIdIndex()
+    if not os.path.isdir(image_dir):
+        return id_index
+
+    with os.scandir(image_dir) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if not entry.name.lower().endswith('.jpg'):
+                continue
+
+            wid = parse_wallpaper_id(entry.name)
+            if wid is not None and (resolution is None or wid.resolution == resolution):
+                id_index.add(entry.name, entry.path)
+
+    return id_index
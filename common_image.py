@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import struct
+
+from common_logger import Logger
+
+"""
+壁纸图片的快速检查
+1、JPEG只读取文件头部的标记段，从SOF段中获取宽和高，不需要PIL解码
+2、非JPEG或者头部格式特殊的文件再使用PIL获取图片信息
+3、下载时边接收边校验，校验通过的图片才写入壁纸目录
+4、先检查数据大小和Content-Length是否一致，JPEG再在尾部查找结束标记，找不到时用PIL完整解码一次后再判断
+"""
+
+logger = Logger('IMAGE')
+
+# SOF0-SOF15，其中C4(DHT)、C8(JPG)、CC(DAC)不是帧头
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+# 没有长度字段的独立标记：TEM、RST0-RST7
+JPEG_STANDALONE_MARKERS = set([0x01]) | set(range(0xD0, 0xD8))
+
+STREAM_HEAD_SIZE = 256 * 1024   # 下载校验时保留的文件头部大小，足够容纳EXIF等标记段
+STREAM_TAIL_SIZE = 64 * 1024    # 下载校验时保留的文件尾部大小，结束标记后面可能还有其他数据
+
+
+def probe_jpeg_size(f):
+    """
+    从JPEG文件头部的SOF段读取图片的宽和高，不是JPEG或没有找到SOF段时返回None
+    1、以二进制方式打开的文件对象，只会读取和跳过标记段的头部
+    """
+
+    if f.read(2) != b'\xff\xd8':
+        return None
+
+    while True:
+        header = f.read(2)
+        if len(header) < 2 or header[0] != 0xFF:
+            return None
+
+        marker = header[1]
+        while marker == 0xFF:       # 标记前允许有多个填充字节0xFF
+            header = f.read(1)
+            if len(header) < 1:
+                return None
+            marker = header[0]
+
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9 or marker == 0xDA:    # 已经到了图像数据或结尾，仍未找到SOF
+            return None
+
+        length_data = f.read(2)
+        if len(length_data) < 2:
+            return None
+        length = struct.unpack('>H', length_data)[0]
+        if length < 2:
+            return None
+
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+
+        f.seek(length - 2, 1)
+
+
+def probe_image_size(image_path):
+    """
+    获取图片的宽、高和格式，JPEG只读取头部，其他情况使用PIL
+    1、图片带路径名称
+    """
+
+    with open(image_path, 'rb') as f:
+        size = probe_jpeg_size(f)
+
+    if size is not None:
+        return size[0], size[1], 'JPEG'
+
+    from PIL import Image   # 只有特殊文件才需要导入PIL
+
+    with Image.open(image_path) as img:
+        return img.width, img.height, img.format
+
+
+class ImageStreamValidator(object):
+    """
+    边下载边校验图片数据，只保留头部和尾部的少量字节
+    1、要求的图片高度，为None时不检查
+    """
+
+    def __init__(self, height=None):
+        self.height = height
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+        self.content_length = None
+
+    def feed(self, chunk):
+        """
+        接收一块下载的数据
+        1、数据块
+        """
+
+        if len(self.head) < STREAM_HEAD_SIZE:
+            self.head.extend(chunk[0:STREAM_HEAD_SIZE - len(self.head)])
+        self.tail.extend(chunk[-STREAM_TAIL_SIZE:])
+        if len(self.tail) > STREAM_TAIL_SIZE:
+            del self.tail[:-STREAM_TAIL_SIZE]
+        self.size = self.size + len(chunk)
+
+    def check(self, image_path=None):
+        """
+        下载完成后校验图片，返回(是否正确, 原因)
+        1、已经写完的图片文件，尾部找不到JPEG结束标记或者不是JPEG时用PIL完整解码，为None时不解码
+        """
+
+        if self.size == 0:
+            return False, 'empty'
+
+        if self.content_length is not None and self.size != self.content_length:
+            return False, 'truncated %s/%s bytes' % (str(self.size), str(self.content_length))
+
+        size = probe_jpeg_size(io.BytesIO(bytes(self.head)))
+        if size is not None:
+            imgwd, imght = size
+            if b'\xff\xd9' not in self.tail:     # 尾部没有结束标记时再完整解码确认
+                ok, reason = load_image_file(image_path)
+                if not ok:
+                    return False, 'truncated jpeg'
+        else:
+            from PIL import Image
+
+            try:
+                with Image.open(io.BytesIO(bytes(self.head))) as img:
+                    imgwd, imght = img.width, img.height
+            except Exception as e:
+                return False, str(e)
+
+            if image_path is not None:      # 其他格式只有头部，完整解码确认数据没有截断
+                ok, reason = load_image_file(image_path)
+                if not ok:
+                    return False, reason
+
+        if self.height is not None and int(imght) != self.height:
+            return False, 'height %s' % str(imght)
+
+        return True, ''
+
+
+def load_image_file(image_path):
+    """
+    使用PIL完整解码图片，数据不完整时解码失败，返回(是否正确, 原因)
+    1、图片带路径名称，为None时返回失败
+    """
+
+    if image_path is None:
+        return False, 'no image file'
+
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as img:
+            img.load()
+    except Exception as e:
+        return False, str(e)
+
+    return True, ''
+
+
+def check_image_file(image_path, height=None):
+    """
+    按下载时的规则检查本地的图片文件，只读取头部和尾部，可以发现尺寸不对和下载不完整的JPEG，
+    返回(是否正确, 原因)
+    1、图片带路径名称
+    2、要求的图片高度，为None时不检查
+    """
+
+    validator = ImageStreamValidator(height)
+    try:
+        with open(image_path, 'rb') as f:
+            validator.feed(f.read(STREAM_HEAD_SIZE))
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size > STREAM_HEAD_SIZE:
+                f.seek(max(file_size - STREAM_TAIL_SIZE, STREAM_HEAD_SIZE))
+                validator.feed(f.read())
+    except OSError as e:
+        return False, str(e)
+
+    return validator.check(image_path)
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import threading
+
+from common_logger import Logger
+from common_identity import WallpaperIdIndex
+
+"""
+壁纸目录的日期索引
+1、一次os.scandir遍历建立 日期 -> 文件名列表 的索引，并保存在壁纸目录下
+2、目录的修改时间没有变化时直接使用已有索引，变化后才重新遍历
+3、按日期检查图片是否存在、统计每月数量都从索引中获取，不再每次glob整个目录
+4、按壁纸标识查找图片，同一张壁纸的不同文件名也能找到
+5、本进程保存或删除图片后直接更新内存中的索引并记录新的目录时间，只有其他原因修改目录时才重新遍历
+6、检查、去重和存储工具共用的递归列出图片
+"""
+
+logger = Logger('LIBRARY')
+
+LIBRARY_INDEX_NAME = '.wallpaper_index.json'
+
+library_indexes = {}
+library_indexes_lock = threading.Lock()
+
+
+class LibraryIndex(object):
+    """
+    壁纸目录的日期索引，文件名格式为 YYYYMMDD_名称.jpg
+    1、壁纸存放的根目录
+    """
+
+    def __init__(self, wp_root_dir):
+        self.wp_root_dir = wp_root_dir
+        self.index_path = os.path.join(wp_root_dir, LIBRARY_INDEX_NAME)
+        self.dates = {}
+        self.ids = None     # 按壁纸标识的索引，使用时才从日期索引建立
+        self.mtime = None
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        读取保存的索引，文件不存在或损坏时忽略
+        """
+
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.dates = data['dates']
+            self.mtime = data['mtime']
+        except Exception as e:
+            logger.error("load the library index error: %s" % str(e))
+            self.dates = {}
+            self.mtime = None
+
+    def save(self):
+        """
+        保存索引，直接覆盖已有文件，不新建文件就不会修改目录时间
+        """
+
+        try:
+            with open(self.index_path, 'w', encoding='utf-8') as f:
+                json.dump({'mtime': self.mtime, 'dates': self.dates}, f)
+        except Exception as e:
+            logger.error("save the library index error: %s" % str(e))
+
+    def scan(self):
+        """
+        遍历一次目录重新建立索引
+        """
+
+        dates = {}
+        with os.scandir(self.wp_root_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if is_library_name(name) and entry.is_file():
+                    dates.setdefault(name[0:8], []).append(name)
+
+        for image_date in dates:
+            dates[image_date].sort()
+
+        self.dates = dates
+        self.ids = None
+
+    def refresh(self):
+        """
+        目录的修改时间变化后重新建立索引并保存
+        """
+
+        with self.lock:
+            try:
+                mtime = os.stat(self.wp_root_dir).st_mtime_ns
+            except OSError:
+                self.dates = {}
+                self.ids = None
+                return
+
+            if mtime != self.mtime:
+                # 记录遍历前的时间，遍历过程中其他线程新增的文件会在下次检查时发现
+                created = not os.path.exists(self.index_path)
+                self.scan()
+                self.mtime = mtime
+                self.save()
+                if created:
+                    # 第一次创建索引文件会修改目录时间，记录保存后的时间，避免下次重复遍历
+                    self.mtime = os.stat(self.wp_root_dir).st_mtime_ns
+                    self.save()
+
+    def touch(self):
+        """
+        本进程修改目录后记录新的目录时间并保存，还没有建立索引时不处理，
+        记录之前其他进程对目录的修改不会再被发现，需要时删除索引文件重新遍历
+        """
+
+        if self.mtime is None:
+            return
+
+        try:
+            self.mtime = os.stat(self.wp_root_dir).st_mtime_ns
+        except OSError:
+            return
+
+        self.save()
+
+    def add(self, image_name):
+        """
+        保存图片后更新索引，不再重新遍历目录
+        1、图片名称，可以带路径
+        """
+
+        file_name = os.path.basename(image_name)
+        with self.lock:
+            if self.mtime is None:
+                return
+
+            if is_library_name(file_name):
+                names = self.dates.setdefault(file_name[0:8], [])
+                if file_name not in names:
+                    names.append(file_name)
+                    names.sort()
+                    if self.ids is not None:
+                        self.ids.add(file_name, file_name)
+            self.touch()
+
+    def remove(self, image_name):
+        """
+        删除图片或临时文件后更新索引，不再重新遍历目录
+        1、图片名称，可以带路径，不在索引中时只记录目录时间
+        """
+
+        file_name = os.path.basename(image_name)
+        with self.lock:
+            if self.mtime is None:
+                return
+
+            names = self.dates.get(file_name[0:8], [])
+            if file_name in names:
+                names.remove(file_name)
+                if len(names) == 0:
+                    del self.dates[file_name[0:8]]
+                self.ids = None
+            self.touch()
+
+    def find(self, image_date):
+        """
+        获取某一天的图片数量和第一张图片的带路径名称
+        1、图片日期
+        """
+
+        self.refresh()
+        names = self.dates.get(str(image_date), [])
+        if len(names) > 0:
+            return len(names), self.wp_root_dir + os.sep + names[0]
+
+        return 0, ''
+
+    def exists(self, image_name):
+        """
+        检查某张图片是否在索引中
+        1、图片名称，可以带路径
+        """
+
+        self.refresh()
+        file_name = os.path.basename(image_name)
+        return file_name in self.dates.get(file_name[0:8], [])
+
+    def find_id(self, image_name):
+        """
+        按壁纸标识查找同一张壁纸的带路径名称，没有返回''
+        1、下载地址或图片名称
+        """
+
+        self.refresh()
+        with self.lock:
+            if self.ids is None:
+                self.ids = WallpaperIdIndex()
+                for image_date in sorted(self.dates):
+                    for file_name in self.dates[image_date]:
+                        self.ids.add(file_name, file_name)
+            file_name = self.ids.get(image_name)
+
+        if file_name is None:
+            return ''
+
+        return self.wp_root_dir + os.sep + file_name
+
+    def count_prefix(self, date_prefix):
+        """
+        获取日期以指定前缀开头的图片数量，例如某一年或某一月
+        1、日期前缀
+        """
+
+        self.refresh()
+        count = 0
+        for image_date in self.dates:
+            if image_date.startswith(str(date_prefix)):
+                count = count + len(self.dates[image_date])
+
+        return count
+
+
+def is_library_name(file_name):
+    """
+    检查文件名是否为 YYYYMMDD_名称.jpg 格式的壁纸
+    1、文件名
+    """
+
+    return len(file_name) > 9 and file_name[8] == '_' and file_name[0:8].isdigit() and file_name.endswith('.jpg')
+
+
+def list_library_images(root_dir):
+    """
+    递归列出目录下所有的jpg图片，同一个目录中按文件名排序，返回[(相对路径, 大小, 修改时间)]
+    1、壁纸存放的根目录
+    """
+
+    images = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        for filename in sorted(filenames):
+            if not filename.endswith('.jpg'):
+                continue
+            image_path = os.path.join(dirpath, filename)
+            st = os.stat(image_path)
+            images.append((os.path.relpath(image_path, root_dir), st.st_size, st.st_mtime_ns))
+
+    return images
+
+
+def open_library_index(wp_root_dir):
+    """
+    获取壁纸目录对应的日期索引，同一个目录只创建一次
+    1、壁纸存放的根目录
+    """
+
+    key = os.path.normpath(wp_root_dir)
+    with library_indexes_lock:
+        if key not in library_indexes:
+            library_indexes[key] = LibraryIndex(wp_root_dir)
+
+        return library_indexes[key]
+
+
+def find_library_index(image_path):
+    """
+    获取图片所在目录已经打开的日期索引，没有打开过则返回None
+    1、图片带路径名称
+    """
+
+    with library_indexes_lock:
+        return library_indexes.get(os.path.normpath(os.path.dirname(image_path)))
+
+
+def library_add(image_path):
+    """
+    本进程保存图片后通知所在目录的日期索引
+    1、图片带路径名称
+    """
+
+    library_index = find_library_index(image_path)
+    if library_index is not None:
+        library_index.add(image_path)
+
+
+def library_remove(image_path):
+    """
+    本进程删除图片或临时文件后通知所在目录的日期索引
+    1、图片或临时文件带路径名称
+    """
+
+    library_index = find_library_index(image_path)
+    if library_index is not None:
+        library_index.remove(image_path)
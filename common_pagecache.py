@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import gzip
+import hashlib
+import threading
+
+from common_logger import Logger
+
+"""
+网页原始内容的本地缓存
+1、爬取到的列表页按(页码, 内容哈希)以gzip压缩保存在壁纸目录下
+2、内容没有变化时不重复写入
+3、解析逻辑修改后可以离线重新解析缓存，不需要重新访问网站
+4、列表有新内容时后面的条目会移到下一页，增量同步只刷新前几页，所以页面变化后旧的内容继续保留，
+   离线解析时先解析每页最新的内容，再从旧内容中补充移动到未刷新页面的条目，只有明确要求时才删除没有补充条目的旧内容
+"""
+
+logger = Logger('PAGE_CACHE')
+
+PAGE_CACHE_DIR = '.page_cache'
+PAGE_FILE_FORMAT = '%s_%04d_%s.html.gz'     # 站点名称_页码_内容哈希.html.gz
+PAGE_FILE_PATTERN = re.compile(r'^(\w+?)_(\d+)_([0-9a-f]+)\.html\.gz$')
+PAGE_HASH_SIZE = 16     # 文件名中保留的哈希长度
+
+page_caches = {}
+page_caches_lock = threading.Lock()
+
+
+def get_content_hash(content):
+    """
+    获取页面内容的哈希
+    1、页面内容
+    """
+
+    return hashlib.sha1(content).hexdigest()[0:PAGE_HASH_SIZE]
+
+
+class PageCache(object):
+    """
+    某个站点列表页的缓存，可以在多个线程中共用
+    1、缓存目录
+    2、站点名称，例如prohui
+    """
+
+    def __init__(self, cache_dir, site):
+        self.cache_dir = cache_dir
+        self.site = site
+        self.pages = {}     # 页码 -> [内容哈希]，最新的内容在前
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        遍历缓存目录，建立页码到内容哈希的索引，同一页的多份内容按修改时间从新到旧排列
+        """
+
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        copies = {}
+        for file_name in os.listdir(self.cache_dir):
+            match = PAGE_FILE_PATTERN.match(file_name)
+            if match is not None and match.group(1) == self.site:
+                mtime = os.path.getmtime(os.path.join(self.cache_dir, file_name))
+                copies.setdefault(int(match.group(2)), []).append((mtime, match.group(3)))
+
+        for page_index in copies:
+            self.pages[page_index] = [content_hash for mtime, content_hash in sorted(copies[page_index], reverse=True)]
+
+    def get_page_path(self, page_index, content_hash):
+        """
+        获取缓存文件带路径名称
+        1、页码
+        2、内容哈希
+        """
+
+        return os.path.join(self.cache_dir, PAGE_FILE_FORMAT % (self.site, int(page_index), content_hash))
+
+    def put(self, page_index, content):
+        """
+        保存一页内容作为该页最新的内容，内容没有变化时不写入，旧的内容保留，返回内容哈希
+        1、页码
+        2、页面内容
+        """
+
+        content_hash = get_content_hash(content)
+        with self.lock:
+            hashes = self.pages.get(int(page_index), [])
+            if len(hashes) > 0 and hashes[0] == content_hash:
+                return content_hash
+
+            try:
+                if not os.path.isdir(self.cache_dir):
+                    os.mkdir(self.cache_dir)
+
+                page_path = self.get_page_path(page_index, content_hash)
+                if content_hash in hashes:      # 页面恢复成以前的内容
+                    os.utime(page_path, None)
+                else:
+                    with gzip.open(page_path + '.part', 'wb') as f:
+                        f.write(content)
+                    os.replace(page_path + '.part', page_path)
+
+                self.pages[int(page_index)] = [content_hash] + [old for old in hashes if old != content_hash]
+
+            except Exception as e:
+                logger.error("save the page cache error: %s" % str(e))
+
+        return content_hash
+
+    def get(self, page_index, content_hash=None):
+        """
+        读取一页缓存的内容，没有缓存时返回None
+        1、页码
+        2、内容哈希，为None时读取最新的内容
+        """
+
+        if content_hash is None:
+            with self.lock:
+                hashes = self.pages.get(int(page_index), [])
+            if len(hashes) == 0:
+                return None
+            content_hash = hashes[0]
+
+        try:
+            with gzip.open(self.get_page_path(page_index, content_hash), 'rb') as f:
+                return f.read()
+        except Exception as e:
+            logger.error("read the page cache error: %s" % str(e))
+            return None
+
+    def old_hashes(self, page_index):
+        """
+        获取某一页被替换的旧内容的哈希，从新到旧排列
+        1、页码
+        """
+
+        with self.lock:
+            return list(self.pages.get(int(page_index), [])[1:])
+
+    def remove_old(self, page_index, content_hash):
+        """
+        删除某一页被替换的旧内容，最新的内容不会删除
+        1、页码
+        2、内容哈希
+        """
+
+        with self.lock:
+            hashes = self.pages.get(int(page_index), [])
+            if content_hash not in hashes[1:]:
+                return
+
+            try:
+                os.remove(self.get_page_path(page_index, content_hash))
+                hashes.remove(content_hash)
+            except Exception as e:
+                logger.error("remove the page cache error: %s" % str(e))
+
+    def page_indexes(self):
+        """
+        获取所有已缓存的页码，从小到大排列
+        """
+
+        with self.lock:
+            return sorted(self.pages)
+
+
+def open_page_cache(wp_root_dir, site):
+    """
+    获取壁纸目录下某个站点的页面缓存，同一个目录和站点只创建一次
+    1、壁纸存放的根目录
+    2、站点名称
+    """
+
+    key = (wp_root_dir, site)
+    with page_caches_lock:
+        if key not in page_caches:
+            page_caches[key] = PageCache(os.path.join(wp_root_dir, PAGE_CACHE_DIR), site)
+
+        return page_caches[key]
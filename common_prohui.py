@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import collections
+import urllib.parse
+
+from lxml import etree
+
+from common_logger import Logger
+from common_http import http_get_retry
+from common_cache import open_metadata_cache
+from common_pagecache import open_page_cache
+from common_identity import parse_wallpaper_id
+
+"""
+prohui网站壁纸列表页的解析
+1、XPath表达式只编译一次，每个壁纸条目直接取日期文本和图片地址属性，不再查询元素后逐个读取
+2、返回带字段名称的记录：日期、1920x1080的CDN下载地址、本地使用的规范图片名称
+3、编译后的XPath对象不能在多个线程中同时使用，解析需要在同一个线程中进行
+4、解析得到的 日期 -> 规范名称 -> 下载地址 保存在元数据缓存中，按日期查找prohui的图片不再依赖其他网站
+"""
+
+logger = Logger('PROHUI')
+
+URL_HUI_BASE = 'https://www.prohui.com/plugin.php?id=mini_download:index&c=14&types=time&page=%s'
+PROHUI_MARKET = 'zh-CN'
+PROHUI_PAGE_SIZE = 14       # 列表每页的壁纸数量，用于估计日期所在的页
+PROHUI_MAX_PAGE = 131       # 列表的最大页数
+PROHUI_SEARCH_PAGES = 3     # 按日期查找时最多请求的页数
+
+ProhuiEntry = collections.namedtuple('ProhuiEntry', ['date', 'url', 'name'])
+
+XPATH_ITEMS = etree.XPath('//ul[@class="appList"]/li[@class="item"]')
+XPATH_DATE = etree.XPath('string(./a/div/span[@class="z"])')
+XPATH_IMAGE = etree.XPath('string(./a/img/@src)')
+
+
+def get_prohui_full_url(thumb_url):
+    """
+    将列表页缩略图地址转换为1920x1080的下载地址
+    1、缩略图地址
+    """
+
+    return thumb_url.strip().replace('/w/500', '/w/1920').replace('/h/284', '/h/1080')
+
+
+def get_prohui_image_name(image_date, image_url):
+    """
+    获取本地使用的规范图片名称，例如20190501_SpringBadlands_ZH-CN8280871661.jpg
+    1、图片日期
+    2、prohui的图片地址
+    """
+
+    wid = parse_wallpaper_id(image_url)
+    if wid is not None:
+        return wid.file_name(image_date)
+
+    str_pic_name = urllib.parse.urlsplit(image_url).path.rsplit('/', 1)[-1]
+
+    image_name = image_date + '_' + str_pic_name
+    image_name = image_name.replace('OHR.', '')
+    image_name = image_name.replace('_1920x1080', '')
+    image_name = image_name.replace('_1080x1920', '')
+
+    return image_name
+
+
+def parse_prohui_listing(content):
+    """
+    解析一页壁纸列表，返回按页面顺序排列的[ProhuiEntry]，格式不正确的条目会被忽略
+    1、页面内容
+    """
+
+    html = etree.HTML(content)
+    if html is None:
+        return []
+
+    entries = []
+    for item in XPATH_ITEMS(html):
+        image_date = XPATH_DATE(item).strip()[0:10].replace('-', '')
+        thumb_url = XPATH_IMAGE(item)
+        if len(image_date) != 8 or thumb_url == '':
+            continue
+
+        image_url = get_prohui_full_url(thumb_url)
+        entries.append(ProhuiEntry(image_date, image_url, get_prohui_image_name(image_date, image_url)))
+
+    return entries
+
+
+def record_prohui_entries(wp_root_dir, entries, replace=True):
+    """
+    将列表页解析得到的壁纸保存到元数据缓存，同一天有多张时保留第一张
+    1、壁纸存放的根目录
+    2、[ProhuiEntry]
+    3、是否覆盖缓存中已有的日期，解析旧的页面内容时为False，避免旧地址覆盖新地址
+    """
+
+    metadata_cache = open_metadata_cache(wp_root_dir)
+    if metadata_cache is None:
+        return
+
+    rows = []
+    dates = set()
+    for entry in entries:
+        if entry.date not in dates:
+            dates.add(entry.date)
+            rows.append((entry.date, entry.name, entry.url, entry.date))
+
+    metadata_cache.put_many('prohui', PROHUI_MARKET, rows, replace)
+
+
+class ProhuiListResolver(object):
+    """
+    按日期查找prohui壁纸，根据日期间隔估计所在的页，不在该页时向前或向后翻页
+    1、每页的壁纸数量
+    2、最大页数
+    """
+
+    def __init__(self, page_size=PROHUI_PAGE_SIZE, max_page=PROHUI_MAX_PAGE):
+        self.page_size = page_size
+        self.max_page = max_page
+        self.images = {}
+        self.pages = {}     # 页码 -> [请求完成的事件, 该页的壁纸]
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """
+        清空已经获取的列表
+        """
+
+        with self.lock:
+            self.images = {}
+            self.pages = {}
+
+    def fetch_page(self, wp_root_dir, page):
+        """
+        获取列表的某一页并保存到页面缓存和元数据缓存，失败返回空列表
+        1、壁纸存放的根目录
+        2、页码，从1开始
+        """
+
+        response = http_get_retry(URL_HUI_BASE % str(page))
+        if response is None:
+            logger.error("network error,can not get the prohui page: %s" % str(page))
+            return []
+
+        open_page_cache(wp_root_dir, 'prohui').put(page, response.content)
+        entries = parse_prohui_listing(response.content)
+        record_prohui_entries(wp_root_dir, entries)
+        return entries
+
+    def get_page(self, wp_root_dir, page):
+        """
+        获取列表的某一页，每一页只请求一次，其他线程请求同一页时等待该页请求完成，不同的页可以并发请求
+        1、壁纸存放的根目录
+        2、页码，从1开始
+        """
+
+        with self.lock:
+            waiter = self.pages.get(page)
+            owner = waiter is None
+            if owner:
+                waiter = [threading.Event(), []]
+                self.pages[page] = waiter
+
+        if not owner:
+            waiter[0].wait()
+            return waiter[1]
+
+        try:
+            entries = self.fetch_page(wp_root_dir, page)
+            with self.lock:
+                waiter[1] = entries
+                for entry in entries:
+                    self.images.setdefault(entry.date, entry)
+        finally:
+            waiter[0].set()
+
+        return waiter[1]
+
+    def get(self, wp_root_dir, image_date, idate_delta):
+        """
+        通过日期获取壁纸，没有则返回None
+        1、壁纸存放的根目录
+        2、图片日期
+        3、日期间隔，用于估计所在的页
+        """
+
+        image_date = str(image_date)
+        page = min(max(int(idate_delta) // self.page_size + 1, 1), self.max_page)
+        for i in range(PROHUI_SEARCH_PAGES):
+            with self.lock:
+                if image_date in self.images:
+                    break
+
+            dates = [entry.date for entry in self.get_page(wp_root_dir, page)]
+            if len(dates) == 0:
+                break
+
+            if image_date > max(dates):     # 列表从新到旧排列
+                page = page - 1
+            elif image_date < min(dates):
+                page = page + 1
+            else:
+                break
+
+            if page < 1 or page > self.max_page:
+                break
+
+        with self.lock:
+            return self.images.get(image_date)
+
+
+prohui_list = ProhuiListResolver()
+
+
+def get_prohui_entry_by_date(wp_root_dir, image_date, idate_delta):
+    """
+    获取prohui某一天的壁纸，先查元数据缓存，没有时查找列表页，返回ProhuiEntry，没有则返回None
+    1、壁纸存放的根目录
+    2、图片日期
+    3、日期间隔
+    """
+
+    metadata_cache = open_metadata_cache(wp_root_dir)
+    if metadata_cache is not None:
+        cached = metadata_cache.get('prohui', PROHUI_MARKET, image_date)
+        if cached is not None:
+            return ProhuiEntry(str(image_date), cached[1], cached[0])
+
+    return prohui_list.get(wp_root_dir, image_date, idate_delta)
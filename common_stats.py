@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import random
+import threading
+
+from common_logger import Logger
+
+"""
+壁纸来源的成功率和耗时统计
+1、按日期远近分组，分别记录每个来源的尝试次数、成功次数和总耗时，保存在壁纸目录下
+2、按照得到一张正确图片的期望耗时(平均耗时 / 成功率)给来源排序
+3、没有统计数据时保持默认顺序
+4、尝试次数超过上限后所有计数减半，较早的结果权重逐渐降低，来源恢复后排序能跟着变化
+5、少量下载随机把一个排在后面的来源提到最前，偶尔失败过的来源还有机会重新统计
+"""
+
+logger = Logger('STATS')
+
+SOURCE_STATS_NAME = '.wallpaper_sources.json'
+DATE_BUCKETS = [(16, 'recent'), (365, 'year')]     # (日期间隔上限, 分组名称)，超过的为old
+PRIOR_LATENCY = 2.0         # 没有数据时假设的单次耗时，单位秒
+DECAY_ATTEMPTS = 50         # 尝试次数达到该值时所有计数减半
+EXPLORE_RATE = 0.05         # 随机调整来源顺序的比例
+
+source_stats = {}
+source_stats_lock = threading.Lock()
+
+
+def get_date_bucket(idate_delta):
+    """
+    获取日期间隔所在的分组
+    1、日期间隔
+    """
+
+    for max_delta, bucket in DATE_BUCKETS:
+        if int(idate_delta) < max_delta:
+            return bucket
+
+    return 'old'
+
+
+class SourceStats(object):
+    """
+    来源统计数据，分组 -> 来源 -> [尝试次数, 成功次数, 总耗时]
+    1、壁纸存放的根目录
+    """
+
+    def __init__(self, wp_root_dir):
+        self.stats_path = os.path.join(wp_root_dir, SOURCE_STATS_NAME)
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        读取保存的统计数据，文件不存在或损坏时忽略
+        """
+
+        if not os.path.exists(self.stats_path):
+            return
+
+        try:
+            with open(self.stats_path, 'r', encoding='utf-8') as f:
+                self.stats = json.load(f)
+        except Exception as e:
+            logger.error("load the source stats error: %s" % str(e))
+            self.stats = {}
+
+    def save(self):
+        """
+        保存统计数据
+        """
+
+        with self.lock:
+            try:
+                with open(self.stats_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.stats, f)
+            except Exception as e:
+                logger.error("save the source stats error: %s" % str(e))
+
+    def record(self, source, idate_delta, ok, elapsed):
+        """
+        记录一次下载的结果
+        1、来源名称
+        2、日期间隔
+        3、是否得到正确的图片
+        4、耗时，单位秒
+        """
+
+        with self.lock:
+            bucket = self.stats.setdefault(get_date_bucket(idate_delta), {})
+            item = bucket.setdefault(source, [0, 0, 0.0])
+            if item[0] >= DECAY_ATTEMPTS:
+                item[0], item[1], item[2] = item[0] / 2.0, item[1] / 2.0, item[2] / 2.0
+            item[0] = item[0] + 1
+            item[1] = item[1] + (1 if ok else 0)
+            item[2] = item[2] + elapsed
+
+    def expected_cost(self, source, idate_delta):
+        """
+        从该来源得到一张正确图片的期望耗时，使用平滑避免数据太少时结果极端
+        1、来源名称
+        2、日期间隔
+        """
+
+        with self.lock:
+            attempts, successes, total_time = \
+                self.stats.get(get_date_bucket(idate_delta), {}).get(source, [0, 0, 0.0])
+
+        success_rate = (successes + 1.0) / (attempts + 2.0)
+        latency = (total_time + PRIOR_LATENCY) / (attempts + 1.0)
+        return latency / success_rate
+
+    def order(self, sources, idate_delta):
+        """
+        按期望耗时从小到大给来源排序，耗时相同时保持原来的顺序，按EXPLORE_RATE的比例随机把后面的一个来源提到最前
+        1、来源名称列表，按默认优先级排列
+        2、日期间隔
+        """
+
+        ordered = sorted(sources, key=lambda source: self.expected_cost(source, idate_delta))
+        if len(ordered) > 1 and random.random() < EXPLORE_RATE:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+
+        return ordered
+
+    def log_summary(self):
+        """
+        输出每个分组中各来源的统计数据
+        """
+
+        with self.lock:
+            for bucket in sorted(self.stats):
+                for source in sorted(self.stats[bucket]):
+                    attempts, successes, total_time = self.stats[bucket][source]
+                    logger.info("source %s [%s]: %.1f/%.1f success, %.2f s average"
+                                % (source, bucket, successes, attempts,
+                                   total_time / attempts if attempts > 0 else 0.0))
+
+
+def open_source_stats(wp_root_dir):
+    """
+    获取壁纸目录对应的来源统计，同一个目录只读取一次
+    1、壁纸存放的根目录
+    """
+
+    with source_stats_lock:
+        if wp_root_dir not in source_stats:
+            source_stats[wp_root_dir] = SourceStats(wp_root_dir)
+
+        return source_stats[wp_root_dir]
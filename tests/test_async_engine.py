@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+在本地模拟的必应和ioliu服务器上测试异步下载引擎
+1、正常下载
+2、必应返回404时换ioliu下载
+3、数据不完整的图片不会进入壁纸目录
+"""
+
+import io
+import os
+import sys
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+Image = pytest.importorskip('PIL.Image')
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BingWallpaper
+import BingWallpaperAsync
+
+
+def make_jpeg(height=BingWallpaper.IMAGE_HEIGHT):
+    """
+    生成一张指定高度的JPEG图片
+    1、图片高度
+    """
+
+    buf = io.BytesIO()
+    Image.new('RGB', (1920, height), (40, 80, 120)).save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+def image_name(idate_delta):
+    """
+    某一天在模拟服务器上的壁纸名称
+    1、日期间隔
+    """
+
+    return 'Test%s_ZH-CN%s' % (str(idate_delta), str(idate_delta))
+
+
+class StandInServer(object):
+    """
+    模拟必应归档、必应图片、ioliu接口和ioliu图片，每个来源的图片可以设置为ok、404或truncated
+    1、必应图片的返回方式
+    2、ioliu图片的返回方式
+    """
+
+    def __init__(self, bing_mode='ok', ioliu_mode='ok'):
+        self.modes = {'bing': bing_mode, 'ioliu': ioliu_mode}
+        self.requests = []
+        self.jpeg = make_jpeg()
+        self.runner = None
+        self.base_url = ''
+
+    async def archive(self, request):
+        idx = int(request.query['idx'])
+        images = []
+        for idate_delta in range(idx, idx + BingWallpaper.BING_ARCHIVE_PAGE):
+            images.append({'enddate': BingWallpaper.get_date_from_today_by_delta(idate_delta),
+                           'url': '/th?id=OHR.%s_1920x1080.jpg&rf=x' % image_name(idate_delta)})
+        return web.json_response({'images': images})
+
+    async def ioliu_api(self, request):
+        idate_delta = int(request.query['d'])
+        return web.json_response({'status': {'code': 200},
+                                  'data': {'enddate': BingWallpaper.get_date_from_today_by_delta(idate_delta),
+                                           'url': 'http://h/%s_1920x1080.jpg' % image_name(idate_delta)}})
+
+    def image_response(self, source):
+        self.requests.append(source)
+        mode = self.modes[source]
+        if mode == '404':
+            return web.Response(status=404)
+        if mode == 'truncated':
+            return web.Response(body=self.jpeg[:len(self.jpeg) // 2])
+        return web.Response(body=self.jpeg)
+
+    async def bing_image(self, request):
+        return self.image_response('bing')
+
+    async def ioliu_image(self, request):
+        return self.image_response('ioliu')
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/HPImageArchive.aspx', self.archive)
+        app.router.add_get('/v1/', self.ioliu_api)
+        app.router.add_get('/th', self.bing_image)
+        app.router.add_get('/photo/{name}', self.ioliu_image)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = 'http://127.0.0.1:%s' % str(port)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.runner.cleanup()
+
+
+def run_engine(wp_root_dir, date_deltas, bing_mode='ok', ioliu_mode='ok'):
+    """
+    在模拟服务器上运行异步下载引擎，返回(下载失败的图片, 服务器收到的图片请求)
+    1、壁纸目录
+    2、日期间隔列表
+    3、必应图片的返回方式
+    4、ioliu图片的返回方式
+    """
+
+    async def run():
+        async with StandInServer(bing_mode, ioliu_mode) as server:
+            fail_image = await BingWallpaperAsync.download_assign_num_wallpaper_async(
+                date_deltas, wp_root_dir, 2,
+                url_bing=server.base_url,
+                url_bing_api=server.base_url + '/HPImageArchive.aspx',
+                url_ioliu_api=server.base_url + '/v1/',
+                url_ioliu_photo=server.base_url + '/photo/')
+            return fail_image, server.requests
+
+    return asyncio.run(run())
+
+
+def list_images(wp_root_dir):
+    return sorted(name for name in os.listdir(wp_root_dir) if name.endswith('.jpg') or name.endswith('.part'))
+
+
+def expected_images(date_deltas):
+    return sorted('%s_%s.jpg' % (BingWallpaper.get_date_from_today_by_delta(idate_delta), image_name(idate_delta))
+                  for idate_delta in date_deltas)
+
+
+def test_download_success(tmp_path):
+    fail_image, requests = run_engine(str(tmp_path), [0, 1, 2, 3])
+
+    assert fail_image == {}
+    assert list_images(str(tmp_path)) == expected_images([0, 1, 2, 3])
+    assert requests == ['bing'] * 4     # 名称一致时优先从必应下载
+
+
+def test_bing_404_falls_back_to_ioliu(tmp_path):
+    fail_image, requests = run_engine(str(tmp_path), [0, 1], bing_mode='404')
+
+    assert fail_image == {}
+    assert list_images(str(tmp_path)) == expected_images([0, 1])
+    assert sorted(requests) == ['bing', 'bing', 'ioliu', 'ioliu']
+
+
+def test_truncated_image_is_rejected(tmp_path):
+    fail_image, requests = run_engine(str(tmp_path), [0], bing_mode='truncated', ioliu_mode='truncated')
+
+    image_date = BingWallpaper.get_date_from_today_by_delta(0)
+    assert list(fail_image) == [image_date]
+    assert list_images(str(tmp_path)) == []     # 不完整的图片和临时文件都不会留在壁纸目录
+    assert requests == ['bing', 'ioliu']